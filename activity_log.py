@@ -0,0 +1,193 @@
+import atexit
+import queue
+import threading
+import time
+from datetime import datetime
+
+# Modalità di scrittura supportate:
+#   'sync'  -> ogni attività viene salvata subito con il proprio commit
+#   'async' -> le attività vengono accodate e salvate a blocchi da un thread in background
+DURABILITY_MODES = ('sync', 'async')
+
+
+# Scrittore delle attività utente con coda limitata e inserimenti in blocco
+class ActivityLogWriter:
+    def __init__(self, app, db, activity_model, user_model, durability='async',
+                 max_queue=10000, batch_size=500, flush_interval=0.5, max_attempts=3, retry_delay=0.1):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f'Modalità di durabilità non valida: {durability}')
+
+        self.app = app
+        self.db = db
+        self.activity_model = activity_model
+        self.user_model = user_model
+        self.durability = durability
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # Tentativi di salvataggio di un blocco (con attesa raddoppiata a ogni errore) prima di scartarlo
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stopping = threading.Event()
+        # Funzione opzionale on_flush(rows) chiamata dopo ogni blocco salvato (es. per notificare
+        # le attività agli altri processi worker con una sola scrittura per blocco)
+        self.on_flush = None
+
+        # Metriche esposte da stats()
+        self.enqueued = 0
+        self.written = 0
+        self.overflow = 0
+        self.flush_count = 0
+        self.flush_errors = 0
+        self.dropped = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    def after_fork(self):
+        # Nel processo figlio il thread di scrittura non esiste: riparte alla prima attività
+        self._queue = queue.Queue(maxsize=self._queue.maxsize)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def log(self, user_id, activity_type, description, city=None, created_at=None):
+        row = {
+            'user_id': user_id,
+            'activity_type': activity_type,
+            'description': description,
+            'city': city,
+            'created_at': created_at or datetime.utcnow()
+        }
+
+        if self.durability == 'sync':
+            self.flush([row])
+            return row
+
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(row)
+            self.enqueued += 1
+        except queue.Full:
+            # Coda piena: scrive direttamente invece di perdere l'attività
+            self.overflow += 1
+            self.flush([row])
+        return row
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='activity-log-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._drain(self.flush_interval)
+            if batch:
+                self.flush(batch)
+        # Svuota quanto rimasto in coda prima di terminare
+        batch = self._drain(0)
+        while batch:
+            self.flush(batch)
+            batch = self._drain(0)
+
+    def _drain(self, timeout):
+        # Raccoglie fino a batch_size righe, attendendo al massimo timeout secondi
+        batch = []
+        deadline = time.monotonic() + timeout
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def flush(self, rows):
+        # Salva il blocco riprovando dopo un errore (es. database bloccato); dopo max_attempts
+        # tentativi falliti le righe vengono scartate e contate in dropped
+        start = time.perf_counter()
+        for attempt in range(self.max_attempts):
+            if attempt:
+                time.sleep(self.retry_delay * 2 ** (attempt - 1))
+            if self._write(rows):
+                break
+        else:
+            self.dropped += len(rows)
+            self.app.logger.error('Scartate %d attività dopo %d tentativi', len(rows), self.max_attempts)
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.flush_count += 1
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self.total_flush_ms += elapsed_ms
+
+    def _write(self, rows):
+        # Inserisce le righe in un'unica transazione e aggiorna l'ultima attività degli utenti;
+        # False se la transazione è fallita
+        last_activity = {}
+        for row in rows:
+            if row['created_at'] > last_activity.get(row['user_id'], datetime.min):
+                last_activity[row['user_id']] = row['created_at']
+
+        user_table = self.user_model.__table__
+        with self.app.app_context():
+            try:
+                self.db.session.execute(self.db.insert(self.activity_model), rows)
+                self.db.session.execute(
+                    user_table.update()
+                    .where(user_table.c.id == self.db.bindparam('b_user_id'))
+                    .where(self.db.or_(user_table.c.last_activity_at.is_(None),
+                                       user_table.c.last_activity_at < self.db.bindparam('b_created_at')))
+                    .values(last_activity_at=self.db.bindparam('b_created_at')),
+                    [{'b_user_id': user_id, 'b_created_at': created_at}
+                     for user_id, created_at in last_activity.items()]
+                )
+                self.db.session.commit()
+                self.written += len(rows)
+            except Exception:
+                self.db.session.rollback()
+                self.flush_errors += 1
+                self.app.logger.exception('Errore nel salvataggio di %d attività', len(rows))
+                return False
+            if self.on_flush is not None:
+                try:
+                    self.on_flush(rows)
+                except Exception:
+                    self.app.logger.exception('Errore nella notifica di %d attività', len(rows))
+        return True
+
+    def stop(self, timeout=10):
+        # Ferma il thread di scrittura dopo aver salvato le attività in coda
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def register_shutdown(self):
+        atexit.register(self.stop)
+
+    def stats(self):
+        return {
+            'durability': self.durability,
+            'queue_depth': self._queue.qsize(),
+            'enqueued': self.enqueued,
+            'written': self.written,
+            'overflow': self.overflow,
+            'flush_count': self.flush_count,
+            'flush_errors': self.flush_errors,
+            'dropped': self.dropped,
+            'last_flush_ms': round(self.last_flush_ms, 3),
+            'max_flush_ms': round(self.max_flush_ms, 3),
+            'avg_flush_ms': round(self.total_flush_ms / self.flush_count, 3) if self.flush_count else 0.0
+        }
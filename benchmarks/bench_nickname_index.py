@@ -0,0 +1,69 @@
+"""Confronta la ricerca dei nickname con ILIKE sul database e con NicknameIndex.
+
+Popola un database temporaneo con molti utenti (100k per default) e misura:
+  - ilike: la vecchia query User.nickname.ilike('%q%') + lista dei nickname
+  - index: verifica di disponibilità dei 10 candidati tramite l'indice in memoria
+  - endpoint: /nickname-suggestions completo tramite il client di test Flask
+
+    python benchmarks/bench_nickname_index.py --users 100000
+"""
+import argparse
+import random
+import string
+import time
+
+from bench_utils import load_app, summarize
+
+QUERIES = ['ma', 'luca', 'gio', 'sara', 'xx', 'fra', 'ale', 'kod']
+
+
+def random_nickname(index):
+    return random.choice(QUERIES) + ''.join(random.choices(string.ascii_lowercase, k=4)) + str(index)
+
+
+def measure(function, repetitions):
+    latencies = []
+    start = time.perf_counter()
+    for i in range(repetitions):
+        query_start = time.perf_counter()
+        function(QUERIES[i % len(QUERIES)])
+        latencies.append(time.perf_counter() - query_start)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--repetitions', type=int, default=200)
+    args = parser.parse_args()
+
+    sito, _ = load_app()
+    with sito.app.app_context():
+        sito.db.session.execute(
+            sito.db.insert(sito.User),
+            [{'nickname': random_nickname(i), 'email': f'user{i}@bench.local', 'password_hash': 'x'}
+             for i in range(args.users)]
+        )
+        sito.db.session.commit()
+        start = time.perf_counter()
+        sito.nickname_index.load(nickname for (nickname,) in sito.db.session.query(sito.User.nickname))
+        print(f'Indice caricato: {len(sito.nickname_index)} nickname in {time.perf_counter() - start:.3f}s')
+
+        def with_ilike(query):
+            users = sito.User.query.filter(sito.User.nickname.ilike(f'%{query}%')).all()
+            existing = [user.nickname for user in users]
+            return [candidate for candidate in (f'{query}96', f'{query}00', f'{query}_1') if candidate not in existing]
+
+        def with_index(query):
+            return [candidate for candidate in (f'{query}96', f'{query}00', f'{query}_1')
+                    if not sito.nickname_index.is_taken(candidate)]
+
+        print(f"ilike    {measure(with_ilike, args.repetitions)}")
+        print(f"index    {measure(with_index, args.repetitions)}")
+
+    client = sito.app.test_client()
+    print(f"endpoint {measure(lambda query: client.get('/nickname-suggestions', query_string={'q': query}), args.repetitions)}")
+
+
+if __name__ == '__main__':
+    main()
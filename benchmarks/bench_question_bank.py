@@ -0,0 +1,37 @@
+"""Confronta la risposta di /api/quiz/questions con e senza la banca domande precompilata.
+
+  - jsonify: random.sample(quiz_questions, 30) serializzato a ogni richiesta
+  - question_bank: unione dei frammenti JSON già serializzati
+
+    python benchmarks/bench_question_bank.py --iterations 20000
+"""
+import argparse
+import random
+import timeit
+
+from bench_utils import load_app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    sito, _ = load_app()
+    app = sito.app
+
+    def with_jsonify():
+        return sito.jsonify(random.sample(sito.quiz_questions, min(sito.QUIZ_SIZE, len(sito.quiz_questions))))
+
+    def with_question_bank():
+        return sito.Response(sito.question_bank.draw(sito.QUIZ_SIZE)[2], mimetype='application/json')
+
+    with app.test_request_context('/api/quiz/questions'):
+        for name, function in (('jsonify', with_jsonify), ('question_bank', with_question_bank)):
+            seconds = timeit.timeit(function, number=args.iterations)
+            print(f'{name:15} {seconds / args.iterations * 1e6:8.1f} µs/richiesta '
+                  f'({args.iterations / seconds:,.0f} richieste/s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,385 @@
+"""Benchmark riproducibile delle route principali di sito.py.
+
+Popola un database SQLite con utenti e attività sintetici (numeri
+configurabili, generatore casuale con seme fisso), sostituisce
+OpenWeatherMap con il server finto a latenza configurabile e interroga le
+route reali con utenti autenticati:
+  - testclient: il client di test di Flask, una richiesta alla volta
+    (costo per richiesta senza rete); il numero di query SQL per endpoint
+    viene letto dalle metriche dell'app (metrics.py)
+  - server: un server WSGI con più processi (prefork) e più client HTTP
+    concorrenti
+
+Per ogni scenario riporta req/s, p50/p95/p99, errori e query SQL per
+richiesta. I risultati possono essere salvati come baseline JSON e
+confrontati con un'esecuzione successiva:
+
+    python benchmarks/bench_routes.py --users 5000 --activities 200000 --save baseline.json
+    python benchmarks/bench_routes.py --users 5000 --activities 200000 --compare baseline.json
+    python benchmarks/bench_routes.py --mode server --processes 4 --concurrency 16 --only scoreboard,profile
+
+Nel modo server i worker condividono lo stato come con gunicorn.conf.py
+(SHARED_STATE_PATH accanto al database di benchmark).
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+
+from bench_utils import BENCH_PASSWORD, ROOT, load_app, logged_in_client, summarize
+
+CITIES = ['Roma', 'Milano', 'Napoli', 'Torino', 'Firenze', 'Bologna', 'Genova', 'Bari']
+ACTIVITY_TYPES = ['login', 'quiz', 'quiz_completion', 'weather']
+SEED_CHUNK = 10000
+
+
+# --- popolamento del database ---
+
+def seed_database(sito, users, activities, seed):
+    # Inserisce utenti bench1..benchN e attività casuali; un database già popolato viene riusato
+    rng = random.Random(seed)
+    User, UserActivity, db = sito.User, sito.UserActivity, sito.db
+    with sito.app.app_context():
+        existing = db.session.query(db.func.count(User.id)).scalar()
+        if existing >= users:
+            print(f'Database già popolato ({existing} utenti), nessun inserimento')
+        else:
+            # Stesso hash per tutti: la password di ogni utente è BENCH_PASSWORD
+            password_hash = sito.password_policy.hash(BENCH_PASSWORD)
+            start = datetime(2024, 1, 1)
+            for first in range(existing + 1, users + 1, SEED_CHUNK):
+                rows = [{'nickname': f'bench{i}', 'email': f'bench{i}@bench.local',
+                         'password_hash': password_hash, 'total_score': rng.randint(0, 500),
+                         'created_at': start}
+                        for i in range(first, min(first + SEED_CHUNK, users + 1))]
+                db.session.execute(db.insert(User), rows)
+
+            for first in range(0, activities, SEED_CHUNK):
+                rows = [{'user_id': rng.randint(1, users), 'activity_type': rng.choice(ACTIVITY_TYPES),
+                         'description': 'Attività di benchmark', 'city': None,
+                         'created_at': start + timedelta(seconds=i * 30)}
+                        for i in range(first, min(first + SEED_CHUNK, activities))]
+                db.session.execute(db.insert(UserActivity), rows)
+
+            db.session.execute(db.text(
+                'UPDATE user SET last_activity_at = '
+                '(SELECT MAX(created_at) FROM user_activity WHERE user_activity.user_id = user.id)'))
+            db.session.commit()
+            print(f'Inseriti {users - existing} utenti e {activities} attività')
+
+        # Gli indici in memoria sono stati caricati all'import, prima del popolamento
+        sito.nickname_index.load(nickname for (nickname,) in db.session.query(User.nickname))
+        sito.leaderboard.load(db.session.query(User.id, User.total_score).all())
+
+
+# --- client HTTP: stessa interfaccia per il client di test e per il server reale ---
+
+class TestClientTransport:
+    def __init__(self, sito, nickname):
+        self.client = logged_in_client(sito, nickname)
+
+    def request(self, method, path, json_body=None):
+        response = self.client.open(path, method=method, json=json_body)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HttpTransport:
+    def __init__(self, base_url, nickname):
+        import requests
+        self.base_url = base_url
+        self.session = requests.Session()
+        response = self.session.post(f'{base_url}/login', allow_redirects=False,
+                                     data={'email': f'{nickname}@bench.local', 'password': BENCH_PASSWORD})
+        if response.status_code != 302:
+            raise RuntimeError(f'Login fallito per {nickname}: {response.status_code}')
+
+    def request(self, method, path, json_body=None):
+        response = self.session.request(method, f'{self.base_url}{path}', json=json_body)
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = None
+        return response.status_code, payload
+
+
+# --- scenari: (nome, endpoint Flask, funzione che prepara la richiesta misurata) ---
+# prepare(transport, rng, users) restituisce (metodo, percorso, corpo JSON)
+
+def _get(path, **params):
+    return 'GET', f'{path}?{urlencode(params)}' if params else path, None
+
+
+def prepare_quiz_submit(transport, rng, users):
+    # Il quiz va prima aperto (fuori dal tempo misurato), poi si misura la consegna
+    status, payload = transport.request('GET', '/api/quiz/questions')
+    if status != 200:
+        return 'POST', '/api/quiz/submit', {}
+    answers = [rng.randint(0, len(question['options']) - 1) for question in payload['questions']]
+    return 'POST', '/api/quiz/submit', {'session_id': payload['session_id'], 'answers': answers}
+
+
+SCENARIOS = [
+    ('homepage', 'homepage', lambda transport, rng, users: _get('/homepage')),
+    ('profile', 'profile', lambda transport, rng, users: _get('/profile')),
+    ('scoreboard', 'scoreboard', lambda transport, rng, users: _get('/scoreboard')),
+    ('scoreboard_api', 'scoreboard_api',
+     lambda transport, rng, users: _get('/api/scoreboard', after_score=rng.randint(0, 500), after_id=0)),
+    ('scoreboard_rank', 'scoreboard_rank',
+     lambda transport, rng, users: _get(f'/api/scoreboard/rank/{rng.randint(1, users)}')),
+    ('nickname_suggestions', 'nickname_suggestions',
+     lambda transport, rng, users: _get('/nickname-suggestions', q=f'bench{rng.randint(1, 99)}')),
+    ('quiz_questions', 'get_quiz_questions', lambda transport, rng, users: _get('/api/quiz/questions')),
+    ('quiz_submit', 'submit_quiz', prepare_quiz_submit),
+    ('city_suggestions', 'city_suggestions',
+     lambda transport, rng, users: _get('/city-suggestions', q=rng.choice(CITIES)[:3])),
+    ('weather', 'weather', lambda transport, rng, users: _get('/weather', city=rng.choice(CITIES))),
+]
+
+
+def run_scenario(transports, prepare, requests_count, warmup, seed, users):
+    # Ogni thread usa il proprio client autenticato; le latenze comprendono solo la richiesta misurata
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    counter = iter(range(warmup + requests_count))
+
+    def worker(index):
+        transport = transports[index]
+        rng = random.Random(seed + index)
+        while True:
+            with lock:
+                n = next(counter, None)
+            if n is None:
+                return
+            method, path, json_body = prepare(transport, rng, users)
+            start = time.perf_counter()
+            status, _ = transport.request(method, path, json_body)
+            elapsed = time.perf_counter() - start
+            if n < warmup:
+                continue
+            with lock:
+                latencies.append(elapsed)
+                if status >= 400:
+                    errors[0] += 1
+
+    start = time.perf_counter()
+    if len(transports) == 1:
+        worker(0)
+    else:
+        with ThreadPoolExecutor(max_workers=len(transports)) as pool:
+            list(pool.map(worker, range(len(transports))))
+    result = summarize(latencies, time.perf_counter() - start)
+    result['errors'] = errors[0]
+    return result
+
+
+# --- query SQL per endpoint, lette dall'output di /metrics ---
+
+SQL_SAMPLE = re.compile(r'^kodland_request_sql_queries_(sum|count)\{endpoint="([^"]+)",method="[A-Z]+"\} (\S+)$',
+                        re.MULTILINE)
+
+
+def sql_query_totals(metrics_text):
+    totals = {}
+    for kind, endpoint, value in SQL_SAMPLE.findall(metrics_text):
+        entry = totals.setdefault(endpoint, {'sum': 0.0, 'count': 0.0})
+        entry[kind] += float(value)
+    return totals
+
+
+def run_testclient(sito, scenarios, args):
+    transport = TestClientTransport(sito, 'bench1')
+    results = {}
+    for name, endpoint, prepare in scenarios:
+        before = sql_query_totals(sito.metrics.render()).get(endpoint, {'sum': 0.0, 'count': 0.0})
+        result = run_scenario([transport], prepare, args.requests, args.warmup, args.seed, args.users)
+        after = sql_query_totals(sito.metrics.render()).get(endpoint, {'sum': 0.0, 'count': 0.0})
+        handled = after['count'] - before['count']
+        result['sql_queries'] = round((after['sum'] - before['sum']) / handled, 2) if handled else None
+        results[name] = result
+        print_row(name, result)
+    return results
+
+
+# --- server WSGI prefork ---
+
+def serve(args):
+    # Processo server: importa l'app, apre il socket e crea i worker con fork
+    import logging
+    from werkzeug.serving import make_server
+
+    sito, _ = load_app(args.db)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, sito.app, threaded=False)
+
+    children = []
+    for _ in range(args.processes):
+        pid = os.fork()
+        if pid == 0:
+            # Connessioni e thread del processo padre non vanno condivisi (come post_fork di gunicorn)
+            sito.init_worker()
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            server.serve_forever()
+            os._exit(0)
+        children.append(pid)
+
+    def stop(signum, frame):
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+        for pid in children:
+            os.waitpid(pid, 0)
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    print(f'READY {server.server_port}', flush=True)
+    while True:
+        signal.pause()
+
+
+def run_server(scenarios, args):
+    command = [sys.executable, os.path.abspath(__file__), '--serve',
+               '--db', args.db, '--processes', str(args.processes)]
+    # I worker condividono sessioni dei quiz, cache e invalidazioni tramite un file SQLite
+    env = dict(os.environ, SHARED_STATE_PATH=os.path.join(os.path.dirname(args.db), 'shared_state.db'))
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True, cwd=ROOT, env=env)
+    try:
+        line = process.stdout.readline()
+        if not line.startswith('READY'):
+            raise RuntimeError('Il server di benchmark non si è avviato')
+        base_url = f'http://127.0.0.1:{line.split()[1]}'
+
+        transports = [HttpTransport(base_url, f'bench{i + 1}') for i in range(args.concurrency)]
+        results = {}
+        for name, endpoint, prepare in scenarios:
+            result = run_scenario(transports, prepare, args.requests, args.warmup, args.seed, args.users)
+            # Con più processi le metriche sono per worker: le query per richiesta vengono dal testclient
+            result['sql_queries'] = None
+            results[name] = result
+            print_row(name, result)
+        return results
+    finally:
+        process.terminate()
+        process.wait()
+
+
+# --- output, baseline e confronto ---
+
+def print_header(title):
+    print(f'\n{title}')
+    print(f'{"scenario":<22}{"req/s":>10}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"errori":>8}{"query":>8}')
+
+
+def print_row(name, result):
+    queries = '-' if result['sql_queries'] is None else f'{result["sql_queries"]:g}'
+    print(f'{name:<22}{result["req_per_s"]:>10}{result["p50_ms"]:>10}{result["p95_ms"]:>10}'
+          f'{result["p99_ms"]:>10}{result["errors"]:>8}{queries:>8}')
+
+
+def _change(old, new):
+    if not old:
+        return '-'
+    return f'{(new - old) / old * 100:+.1f}%'
+
+
+def compare(baseline, report):
+    print(f'\nConfronto con la baseline del {baseline["meta"]["created_at"]}')
+    print(f'{"modo/scenario":<32}{"req/s":>10}{"p95":>10}{"p99":>10}{"query":>14}')
+    for mode, results in report['results'].items():
+        for name, result in results.items():
+            old = baseline['results'].get(mode, {}).get(name)
+            if old is None:
+                continue
+            queries = (f'{old["sql_queries"]:g} -> {result["sql_queries"]:g}'
+                       if old.get('sql_queries') is not None and result['sql_queries'] is not None else '-')
+            print(f'{mode + "/" + name:<32}{_change(old["req_per_s"], result["req_per_s"]):>10}'
+                  f'{_change(old["p95_ms"], result["p95_ms"]):>10}{_change(old["p99_ms"], result["p99_ms"]):>10}'
+                  f'{queries:>14}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--activities', type=int, default=100000)
+    parser.add_argument('--db', help='file SQLite da creare o riusare (default: cartella temporanea)')
+    parser.add_argument('--mode', choices=['testclient', 'server', 'both'], default='testclient')
+    parser.add_argument('--requests', type=int, default=300, help='richieste misurate per scenario')
+    parser.add_argument('--warmup', type=int, default=20, help='richieste iniziali non misurate')
+    parser.add_argument('--processes', type=int, default=4, help='processi del server WSGI')
+    parser.add_argument('--concurrency', type=int, default=8, help='client HTTP concorrenti (modo server)')
+    parser.add_argument('--latency', type=float, default=0.05, help='latenza di OpenWeatherMap in secondi')
+    parser.add_argument('--only', help='elenco di scenari separati da virgola')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--save', help='salva i risultati in questo file JSON')
+    parser.add_argument('--compare', help='confronta con una baseline JSON salvata in precedenza')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    if args.db is None:
+        import tempfile
+        args.db = os.path.join(tempfile.mkdtemp(prefix='kodland-bench-'), 'bench.db')
+    args.db = os.path.abspath(args.db)
+    if args.concurrency > args.users:
+        parser.error('--concurrency non può superare --users (un utente per client)')
+
+    scenarios = SCENARIOS
+    if args.only:
+        selected = set(args.only.split(','))
+        unknown = selected - {name for name, _, _ in SCENARIOS}
+        if unknown:
+            parser.error(f'scenari sconosciuti: {", ".join(sorted(unknown))}')
+        scenarios = [scenario for scenario in SCENARIOS if scenario[0] in selected]
+
+    sito, weather_server = load_app(args.db, weather_latency=args.latency)
+    seed_database(sito, args.users, args.activities, args.seed)
+
+    report = {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'users': args.users,
+            'activities': args.activities,
+            'requests': args.requests,
+            'warmup': args.warmup,
+            'processes': args.processes,
+            'concurrency': args.concurrency,
+            'latency': args.latency,
+            'seed': args.seed
+        },
+        'results': {}
+    }
+
+    if args.mode in ('testclient', 'both'):
+        print_header('Client di test di Flask (sequenziale)')
+        report['results']['testclient'] = run_testclient(sito, scenarios, args)
+    if args.mode in ('server', 'both'):
+        print_header(f'Server WSGI: {args.processes} processi, {args.concurrency} client concorrenti')
+        report['results']['server'] = run_server(scenarios, args)
+
+    print(f'\nChiamate al finto OpenWeatherMap (processo di benchmark): {weather_server.request_counts}')
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f'Risultati salvati in {args.save}')
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
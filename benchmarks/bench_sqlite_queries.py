@@ -0,0 +1,143 @@
+"""Misura le query di profilo e classifica prima e dopo la messa a punto di SQLite.
+
+Crea un database con lo schema dell'app, lo popola con molte attività
+(1M per default) e misura:
+  - profile: ultime 10 attività di un utente casuale
+  - scoreboard: prima pagina della classifica + statistiche aggregate
+  - profile_during_writes: la query del profilo mentre un altro processo
+    scrive attività in transazioni continue
+
+"prima" usa lo schema senza indici e i pragma predefiniti, "dopo" applica
+db_setup.SQLITE_PRAGMAS e db_setup.INDEXES.
+
+    python benchmarks/bench_sqlite_queries.py --users 10000 --activities 1000000
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# bench_utils aggiunge la cartella del progetto al path (serve per importare db_setup)
+from bench_utils import summarize
+import db_setup
+
+SCHEMA = (
+    'CREATE TABLE user (id INTEGER PRIMARY KEY, nickname VARCHAR(100) NOT NULL UNIQUE, '
+    'email VARCHAR(120) NOT NULL UNIQUE, password_hash VARCHAR(128) NOT NULL, total_score INTEGER, '
+    'created_at DATETIME, last_activity_at DATETIME)',
+    'CREATE TABLE user_activity (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES user (id), '
+    'activity_type VARCHAR(50) NOT NULL, description VARCHAR(200) NOT NULL, city VARCHAR(100), '
+    'created_at DATETIME)'
+)
+
+PROFILE_QUERY = ('SELECT * FROM user_activity WHERE user_id = ? '
+                 'ORDER BY created_at DESC LIMIT 10')
+SCOREBOARD_QUERY = 'SELECT * FROM user ORDER BY total_score DESC, id ASC LIMIT 50'
+STATS_QUERY = 'SELECT COUNT(id), MAX(total_score), AVG(total_score) FROM user'
+ACTIVITY_TYPES = ['login', 'quiz', 'quiz_completion', 'weather']
+
+
+def seed(path, users, activities):
+    connection = sqlite3.connect(path)
+    for statement in SCHEMA:
+        connection.execute(statement)
+
+    start = datetime(2024, 1, 1)
+    connection.executemany(
+        'INSERT INTO user VALUES (?, ?, ?, ?, ?, ?, ?)',
+        ((i, f'user{i}', f'user{i}@bench.local', 'x', random.randint(0, 500), start, None)
+         for i in range(1, users + 1))
+    )
+    connection.executemany(
+        'INSERT INTO user_activity (user_id, activity_type, description, city, created_at) '
+        'VALUES (?, ?, ?, ?, ?)',
+        ((random.randint(1, users), random.choice(ACTIVITY_TYPES), 'Attività di benchmark', None,
+          start + timedelta(seconds=i * 30)) for i in range(activities))
+    )
+    connection.commit()
+    connection.close()
+
+
+def connect(path, tuned):
+    connection = sqlite3.connect(path, timeout=30)
+    if tuned:
+        for pragma in db_setup.SQLITE_PRAGMAS:
+            connection.execute(pragma)
+    return connection
+
+
+def measure(function, repetitions):
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        query_start = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - query_start)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def writer(path, tuned, stop, users):
+    # Scrive attività in transazioni da 200 righe finché non viene fermato
+    connection = connect(path, tuned)
+    while not stop.is_set():
+        with connection:
+            connection.executemany(
+                'INSERT INTO user_activity (user_id, activity_type, description, created_at) '
+                'VALUES (?, ?, ?, ?)',
+                [(random.randint(1, users), 'login', 'Scrittura concorrente', datetime.utcnow())
+                 for _ in range(200)]
+            )
+    connection.close()
+
+
+def run(path, tuned, users, repetitions):
+    connection = connect(path, tuned)
+    results = {
+        'profile': measure(
+            lambda: connection.execute(PROFILE_QUERY, (random.randint(1, users),)).fetchall(), repetitions),
+        'scoreboard': measure(
+            lambda: (connection.execute(SCOREBOARD_QUERY).fetchall(),
+                     connection.execute(STATS_QUERY).fetchone()), repetitions)
+    }
+
+    stop = multiprocessing.Event()
+    process = multiprocessing.Process(target=writer, args=(path, tuned, stop, users))
+    process.start()
+    time.sleep(0.2)
+    results['profile_during_writes'] = measure(
+        lambda: connection.execute(PROFILE_QUERY, (random.randint(1, users),)).fetchall(), repetitions)
+    stop.set()
+    process.join()
+    connection.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--activities', type=int, default=1000000)
+    parser.add_argument('--repetitions', type=int, default=50)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix='kodland-sqlite-bench-'), 'bench.db')
+    print(f'Popolamento di {path} ({args.users} utenti, {args.activities} attività)...')
+    seed(path, args.users, args.activities)
+
+    for label in ('prima', 'dopo'):
+        tuned = label == 'dopo'
+        if tuned:
+            connection = connect(path, tuned)
+            for statement in db_setup.INDEXES:
+                connection.execute(statement)
+            connection.commit()
+            connection.close()
+        for name, result in run(path, tuned, args.users, args.repetitions).items():
+            print(f'{label:5} {name:22} {result}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Funzioni comuni agli script di benchmark.
+
+Gli script vanno lanciati dalla radice del progetto, per esempio
+``python benchmarks/bench_weather_spike.py``: l'app viene importata con un
+database SQLite temporaneo e, se richiesto, con il finto OpenWeatherMap.
+"""
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from fake_openweather import FakeOpenWeatherServer  # noqa: E402
+
+BENCH_PASSWORD = 'benchmark'
+
+
+def load_app(db_path=None, weather_latency=None):
+    # Configura l'ambiente prima di importare sito.py, che legge le variabili all'import
+    if db_path is None:
+        db_path = os.path.join(tempfile.mkdtemp(prefix='kodland-bench-'), 'bench.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.abspath(db_path)}'
+
+    server = None
+    if weather_latency is not None:
+        server = FakeOpenWeatherServer(latency=weather_latency).start()
+        os.environ['OPENWEATHER_BASE_URL'] = server.base_url
+
+    import sito
+    return sito, server
+
+
+def ensure_user(sito, nickname):
+    # Crea (se manca) un utente di benchmark e lo restituisce
+    with sito.app.app_context():
+        user = sito.User.query.filter_by(nickname=nickname).first()
+        if user is None:
+            user = sito.User(nickname=nickname, email=f'{nickname}@bench.local')
+            user.set_password(BENCH_PASSWORD)
+            sito.db.session.add(user)
+            sito.db.session.commit()
+        return user.id
+
+
+def logged_in_client(sito, nickname):
+    ensure_user(sito, nickname)
+    client = sito.app.test_client()
+    response = client.post('/login', data={'email': f'{nickname}@bench.local', 'password': BENCH_PASSWORD})
+    if response.status_code != 302:
+        raise RuntimeError(f'Login fallito per {nickname}: {response.status_code}')
+    return client
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies, wall_time):
+    # Riassume una serie di latenze (in secondi) in millisecondi e richieste al secondo
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'req_per_s': round(len(latencies) / wall_time, 1) if wall_time else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2)
+    }
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
@@ -0,0 +1,84 @@
+"""Misura /weather durante un picco di richieste, con e senza single-flight.
+
+Un gruppo di "worker" (thread, come in un server WSGI a thread) invia
+richieste per poche città popolari contro il finto OpenWeatherMap con
+latenza iniettata. Per ogni variante la cache viene svuotata, così si
+misurano le chiamate upstream, il throughput e l'occupazione dei worker
+(tempo speso dentro le richieste / tempo disponibile). Nella variante
+"senza single-flight" ogni richiesta senza cache chiama l'API upstream.
+
+    python benchmarks/bench_weather_spike.py --workers 16 --requests 400 --latency 0.2
+"""
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench_utils import load_app, logged_in_client, summarize
+
+CITIES = ['Roma', 'Milano', 'Napoli', 'Torino', 'Firenze']
+
+
+def without_single_flight(cache, key, fetch):
+    value = fetch()
+    cache.set(key, value)
+    return value
+
+
+def run(sito, server, path, workers, total_requests):
+    sito.weather_client.clear()
+    for kind in server.request_counts:
+        server.request_counts[kind] = 0
+
+    local = threading.local()
+    latencies = []
+    latencies_lock = threading.Lock()
+
+    def client():
+        if not hasattr(local, 'client'):
+            local.client = logged_in_client(sito, f'bench_weather_{threading.get_ident()}')
+        return local.client
+
+    # Login fuori dal tempo misurato
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(lambda _: client(), range(workers * 4)))
+
+        def one_request(i):
+            start = time.perf_counter()
+            response = client().get(path, query_string={'city': CITIES[i % len(CITIES)]})
+            elapsed = time.perf_counter() - start
+            if response.status_code != 200 or 'error' in response.get_json():
+                raise RuntimeError(f'{path}: risposta inattesa {response.get_json()}')
+            with latencies_lock:
+                latencies.append(elapsed)
+
+        start = time.perf_counter()
+        list(pool.map(one_request, range(total_requests)))
+        wall_time = time.perf_counter() - start
+
+    result = summarize(latencies, wall_time)
+    result['worker_occupancy'] = round(sum(latencies) / (workers * wall_time), 3)
+    result['upstream_calls'] = dict(server.request_counts)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--latency', type=float, default=0.2, help='latenza upstream in secondi')
+    args = parser.parse_args()
+
+    sito, server = load_app(weather_latency=args.latency)
+    client = sito.weather_client
+    single_flight = client._single_flight
+    for name, strategy in [('senza single-flight', without_single_flight), ('single-flight', single_flight)]:
+        client._single_flight = strategy
+        result = run(sito, server, '/weather', args.workers, args.requests)
+        print(f'{name:20} {result}')
+    client._single_flight = single_flight
+    print(f'client: {client.stats()}')
+
+
+if __name__ == '__main__':
+    main()
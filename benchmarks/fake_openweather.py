@@ -0,0 +1,125 @@
+"""Server locale che imita le API OpenWeatherMap usate da sito.py.
+
+Risponde a /geo/1.0/direct e /data/2.5/forecast con dati sintetici e
+deterministici, con una latenza configurabile. Si usa impostando
+OPENWEATHER_BASE_URL=http://127.0.0.1:<porta> prima di avviare l'app.
+
+    python benchmarks/fake_openweather.py --port 8089 --latency 0.2
+"""
+import argparse
+import json
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+CONDITIONS = ['cielo sereno', 'poche nuvole', 'nubi sparse', 'pioggia leggera', 'temporale']
+
+
+def _city_seed(name):
+    return zlib.crc32(name.lower().encode('utf-8'))
+
+
+def geocode_payload(query, limit):
+    if query.lower().startswith('zz'):
+        # Prefisso riservato per simulare una città inesistente
+        return []
+    seed = _city_seed(query)
+    results = []
+    for i in range(limit):
+        results.append({
+            'name': query.title() if i == 0 else f'{query.title()} {i}',
+            'lat': round((seed % 18000) / 100 - 90 + i * 0.1, 4),
+            'lon': round((seed // 18000 % 36000) / 100 - 180 + i * 0.1, 4),
+            'country': 'IT',
+            'state': 'Lazio' if i % 2 == 0 else ''
+        })
+    return results
+
+
+def forecast_payload(lat, lon, now=None):
+    now = int(now or time.time())
+    start = now - now % 10800
+    seed = _city_seed(f'{lat},{lon}')
+    entries = []
+    for i in range(40):
+        entries.append({
+            'dt': start + i * 10800,
+            'main': {'temp': round(10 + (seed + i * 7) % 150 / 10, 2)},
+            'weather': [{'id': 800, 'description': CONDITIONS[(seed + i // 4) % len(CONDITIONS)]}]
+        })
+    return {
+        'cod': '200',
+        'cnt': len(entries),
+        'list': entries,
+        'city': {'name': 'Fake', 'coord': {'lat': lat, 'lon': lon}, 'timezone': 7200}
+    }
+
+
+class FakeOpenWeatherServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0):
+        super().__init__(address, FakeOpenWeatherHandler)
+        self.latency = latency
+        self.request_counts = {'geocode': 0, 'forecast': 0}
+        self._counts_lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def count(self, kind):
+        with self._counts_lock:
+            self.request_counts[kind] += 1
+
+    def start(self):
+        # Avvia il server in un thread daemon e lo restituisce
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+
+class FakeOpenWeatherHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if url.path == '/geo/1.0/direct':
+            self.server.count('geocode')
+            self._send(200, geocode_payload(params.get('q', ''), int(params.get('limit', 5))))
+        elif url.path == '/data/2.5/forecast':
+            self.server.count('forecast')
+            self._send(200, forecast_payload(float(params['lat']), float(params['lon'])))
+        else:
+            self._send(404, {'cod': '404', 'message': 'not found'})
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.0, help='latenza iniettata in secondi')
+    args = parser.parse_args()
+
+    server = FakeOpenWeatherServer((args.host, args.port), latency=args.latency)
+    print(f'Fake OpenWeatherMap in ascolto su {server.base_url} (latenza {args.latency}s)')
+    server.serve_forever()
@@ -0,0 +1,116 @@
+from sqlalchemy import event, inspect, text
+
+# Pragma applicati a ogni nuova connessione SQLite
+SQLITE_PRAGMAS = (
+    # WAL: i lettori non vengono bloccati dalle scritture delle attività
+    'PRAGMA journal_mode=WAL',
+    # Con WAL, NORMAL è sicuro contro la corruzione ed evita un fsync per ogni commit
+    'PRAGMA synchronous=NORMAL',
+    # Attende fino a 5 secondi il lock di scrittura invece di fallire subito
+    'PRAGMA busy_timeout=5000',
+    # Circa 64 MB di cache di pagine per connessione (valore negativo = KiB)
+    'PRAGMA cache_size=-65536',
+    # Legge il file del database tramite mmap (fino a 256 MB)
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA temp_store=MEMORY'
+)
+
+# Indici usati da profile() e dalla classifica
+INDEXES = (
+    'CREATE INDEX IF NOT EXISTS ix_user_activity_user_created '
+    'ON user_activity (user_id, created_at DESC)',
+    'CREATE INDEX IF NOT EXISTS ix_user_activity_created ON user_activity (created_at)',
+    'CREATE INDEX IF NOT EXISTS ix_user_total_score ON user (total_score DESC, id)'
+)
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+
+def configure_engine(engine):
+    # Registra i pragma solo per i database SQLite
+    if engine.dialect.name == 'sqlite' and not event.contains(engine, 'connect', _set_sqlite_pragmas):
+        event.listen(engine, 'connect', _set_sqlite_pragmas)
+
+
+# Migrazioni dello schema: ognuna è idempotente, così funziona sia sui database
+# creati da db.create_all() sia su quelli delle versioni precedenti
+def _migration_last_activity_at(connection):
+    columns = [column['name'] for column in inspect(connection).get_columns('user')]
+    if 'last_activity_at' not in columns:
+        connection.execute(text('ALTER TABLE user ADD COLUMN last_activity_at DATETIME'))
+        # Popola la colonna con l'ultima attività già registrata
+        connection.execute(text(
+            'UPDATE user SET last_activity_at = '
+            '(SELECT MAX(created_at) FROM user_activity WHERE user_activity.user_id = user.id)'
+        ))
+
+
+def _migration_indexes(connection):
+    for statement in INDEXES:
+        connection.execute(text(statement))
+
+
+# Tabella delle attività con AUTOINCREMENT: senza, SQLite riassegna max(id)+1 quando le righe con
+# gli id più alti vengono cancellate (es. da activity-maintenance) e le esportazioni incrementali,
+# che usano l'id come watermark, salterebbero le nuove attività con un id già esportato
+USER_ACTIVITY_TABLE = (
+    'CREATE TABLE user_activity ('
+    'id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, '
+    'user_id INTEGER NOT NULL, '
+    'activity_type VARCHAR(50) NOT NULL, '
+    'description VARCHAR(200) NOT NULL, '
+    'city VARCHAR(100), '
+    'created_at DATETIME, '
+    'FOREIGN KEY(user_id) REFERENCES user (id))'
+)
+
+
+def _migration_user_activity_autoincrement(connection):
+    table_sql = connection.execute(text(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'user_activity'"
+    )).scalar()
+    if 'AUTOINCREMENT' in (table_sql or '').upper():
+        return
+    # Ricostruisce la tabella mantenendo gli id (il contatore riparte dall'id più alto presente)
+    connection.execute(text('ALTER TABLE user_activity RENAME TO user_activity_old'))
+    connection.execute(text(USER_ACTIVITY_TABLE))
+    connection.execute(text(
+        'INSERT INTO user_activity (id, user_id, activity_type, description, city, created_at) '
+        'SELECT id, user_id, activity_type, description, city, created_at FROM user_activity_old'
+    ))
+    connection.execute(text('DROP TABLE user_activity_old'))
+    _migration_indexes(connection)
+
+
+MIGRATIONS = (
+    (1, 'colonna user.last_activity_at', _migration_last_activity_at),
+    (2, 'indici per profilo e classifica', _migration_indexes),
+    (3, 'id di user_activity con AUTOINCREMENT', _migration_user_activity_autoincrement),
+)
+
+
+def schema_version(connection):
+    return connection.execute(text('PRAGMA user_version')).scalar()
+
+
+def upgrade_schema(engine):
+    # Applica le migrazioni non ancora eseguite e restituisce quelle applicate
+    applied = []
+    with engine.begin() as connection:
+        current = schema_version(connection)
+        for version, description, migration in MIGRATIONS:
+            if version <= current:
+                continue
+            migration(connection)
+            connection.execute(text(f'PRAGMA user_version = {version}'))
+            applied.append((version, description))
+    return applied
+
+
+def latest_version():
+    return MIGRATIONS[-1][0]
@@ -0,0 +1,135 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, timezone
+
+from sqlalchemy import func, select
+
+# Formati di esportazione: estensione -> tipo MIME
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8'
+}
+
+
+def parse_since(value):
+    # Data ISO 8601 (es. 2024-05-01 o 2024-05-01T02:00:00+02:00) confrontabile con created_at,
+    # che nel database è salvato in UTC senza fuso orario
+    if not value:
+        return None
+    since = datetime.fromisoformat(value)
+    if since.tzinfo is not None:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    return since
+
+
+def _text(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+# Esportazione in streaming di una tabella in CSV o JSONL, facoltativamente compressa con gzip.
+# Le righe vengono lette a blocchi con paginazione keyset sull'id: ogni blocco usa una propria
+# connessione (la transazione di lettura non resta aperta per tutto il download) ed è
+# scorso con yield_per, quindi la memoria usata non dipende dalla dimensione della tabella.
+# Per le esportazioni incrementali il watermark è l'id più alto esportato, da passare come
+# after_id la volta successiva: gli id sono assegnati all'inserimento, quindi crescono con
+# l'ordine dei commit e non vengono mai riusati (user_activity è creata con AUTOINCREMENT, vedi
+# db_setup: senza, SQLite riassegnerebbe gli id delle righe più recenti cancellate dalla
+# manutenzione e un'esportazione successiva le salterebbe). created_at invece è l'ora della
+# richiesta e le attività vengono scritte dopo dal thread in background: un watermark su
+# created_at salterebbe quelle ancora in coda.
+# since filtra comunque per created_at (utile per esportazioni a partire da una data).
+class TableExport:
+    def __init__(self, engine, table, columns, fmt='csv', since=None, after_id=None, compress=False,
+                 chunk_size=5000, batch_size=500, name=None):
+        if fmt not in FORMATS:
+            raise ValueError(f'Formato non supportato: {fmt}')
+        self.engine = engine
+        self.table = table
+        self.name = name or table.name
+        self.columns = [table.c[name] for name in columns]
+        self.fmt = fmt
+        self.since = since
+        self.compress = compress
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.after_id = after_id or 0
+        self.until_id = None
+        self.rows = 0
+        self.watermark = self.after_id
+
+    @property
+    def filename(self):
+        suffix = '.gz' if self.compress else ''
+        return f'{self.name}.{self.fmt}{suffix}'
+
+    @property
+    def mimetype(self):
+        return 'application/gzip' if self.compress else FORMATS[self.fmt]
+
+    def bound(self):
+        # Limita l'esportazione alle righe già presenti adesso e restituisce il watermark finale,
+        # così può essere comunicato prima dell'invio (es. in un header della risposta HTTP)
+        with self.engine.connect() as connection:
+            self.until_id = connection.execute(select(func.max(self.table.c.id))).scalar() or 0
+        return max(self.until_id, self.after_id)
+
+    def batches(self):
+        # Liste di righe (al massimo batch_size) in ordine di id
+        id_column = self.table.c.id
+        created_column = self.table.c.created_at
+        last_id = self.after_id
+        while True:
+            statement = select(*self.columns, id_column.label('_export_id'))
+            statement = statement.where(id_column > last_id)
+            if self.until_id is not None:
+                statement = statement.where(id_column <= self.until_id)
+            if self.since is not None:
+                statement = statement.where(created_column > self.since)
+            statement = statement.order_by(id_column).limit(self.chunk_size)
+
+            count = 0
+            with self.engine.connect() as connection:
+                result = connection.execution_options(yield_per=self.batch_size).execute(statement)
+                for batch in result.partitions():
+                    count += len(batch)
+                    last_id = self.watermark = batch[-1]._export_id
+                    self.rows += len(batch)
+                    yield [row[:len(self.columns)] for row in batch]
+            if count < self.chunk_size:
+                break
+
+    def lines(self):
+        # Testo CSV o JSONL, un pezzo per ogni gruppo di righe
+        names = [column.name for column in self.columns]
+        if self.fmt == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(names)
+            for batch in self.batches():
+                writer.writerows([_text(value) for value in row] for row in batch)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            if buffer.tell():
+                yield buffer.getvalue()
+        else:
+            for batch in self.batches():
+                yield ''.join(
+                    json.dumps(dict(zip(names, map(_text, row))), ensure_ascii=False) + '\n' for row in batch
+                )
+
+    def __iter__(self):
+        # Byte pronti da scrivere su file o da inviare nella risposta HTTP
+        if not self.compress:
+            for text in self.lines():
+                yield text.encode('utf-8')
+            return
+        # wbits=31: formato gzip, compresso un pezzo alla volta
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        for text in self.lines():
+            data = compressor.compress(text.encode('utf-8'))
+            if data:
+                yield data
+        yield compressor.flush()
@@ -0,0 +1,83 @@
+from array import array
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+
+# Nomi italiani per giorni e mesi
+ITALIAN_DAYS = ['Lunedì', 'Martedì', 'Mercoledì', 'Giovedì', 'Venerdì', 'Sabato', 'Domenica']
+ITALIAN_MONTHS = ['GEN', 'FEB', 'MAR', 'APR', 'MAG', 'GIU', 'LUG', 'AGO', 'SET', 'OTT', 'NOV', 'DIC']
+DAY_LABELS = ['Oggi', 'Domani', 'Dopodomani']
+
+# Le previsioni OpenWeatherMap coprono al massimo 5 giorni
+MAX_FORECAST_DAYS = 5
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+# Previsioni giornaliere già aggregate per una località, condivise tra tutti gli utenti
+class DailyForecast:
+    __slots__ = ('utc_offset', 'days')
+
+    def __init__(self, utc_offset, days):
+        # Scostamento dall'UTC della città in secondi (campo city.timezone della risposta)
+        self.utc_offset = utc_offset
+        # Lista ordinata di (data locale, temperatura minima, massima, condizione più frequente)
+        self.days = days
+
+    def local_today(self, now=None):
+        now = now or datetime.now(timezone.utc)
+        return (now + timedelta(seconds=self.utc_offset)).date()
+
+
+def aggregate_forecast(forecast_data):
+    # Converte la lista di previsioni a 3 ore in colonne con un solo passaggio
+    entries = forecast_data.get('list', [])
+    utc_offset = forecast_data.get('city', {}).get('timezone', 0) or 0
+
+    day_numbers = array('l')
+    temps = array('d')
+    conditions = []
+    for item in entries:
+        # Giorno locale della città come numero di giorni dall'epoca Unix
+        day_numbers.append((item['dt'] + utc_offset) // 86400)
+        temps.append(item['main']['temp'])
+        conditions.append(item['weather'][0]['description'])
+
+    # Raggruppa per giorno: i dati arrivano in ordine cronologico, quindi i gruppi sono contigui
+    days = []
+    start = 0
+    for end in range(1, len(day_numbers) + 1):
+        if end < len(day_numbers) and day_numbers[end] == day_numbers[start]:
+            continue
+        day_temps = temps[start:end]
+        most_common = Counter(conditions[start:end]).most_common(1)[0][0]
+        days.append((date.fromordinal(EPOCH_ORDINAL + day_numbers[start]),
+                     min(day_temps), max(day_temps), most_common))
+        start = end
+
+    return DailyForecast(utc_offset, days)
+
+
+def format_forecast(daily_forecast, days=3, now=None):
+    # Prepara le previsioni per i prossimi `days` giorni nel formato usato dalla homepage
+    days = max(1, min(days, MAX_FORECAST_DAYS))
+    today = daily_forecast.local_today(now)
+    last_day = today + timedelta(days=days - 1)
+
+    forecast = []
+    for day, night_temp, day_temp, weather in daily_forecast.days:
+        if day < today or day > last_day:
+            continue
+
+        date_str = f"{ITALIAN_DAYS[day.weekday()]} {day.day} {ITALIAN_MONTHS[day.month - 1]} {day.year}"
+        offset = (day - today).days
+        if offset < len(DAY_LABELS):
+            date_str = f"{DAY_LABELS[offset]} - {date_str}"
+
+        forecast.append({
+            'date': date_str,
+            'weather': weather.capitalize(),
+            'day_temp': round(day_temp),
+            'night_temp': round(night_temp)
+        })
+
+    return forecast
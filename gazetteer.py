@@ -0,0 +1,374 @@
+import csv
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from bisect import bisect_left, insort
+from collections import OrderedDict
+
+# Formato del file binario (little endian):
+#   intestazione: magic, versione, numero di record
+#   record a lunghezza fissa, ordinati per chiave: (offset, lunghezza) di chiave, nome,
+#   regione e paese nel blocco delle stringhe, poi lat, lon e popolazione
+#   blocco delle stringhe UTF-8
+# L'ordine dei byte UTF-8 coincide con quello dei caratteri, quindi la ricerca per
+# prefisso è una ricerca binaria direttamente sui byte mappati in memoria.
+MAGIC = b'KGAZ'
+VERSION = 1
+HEADER = struct.Struct('<4sHI')
+RECORD = struct.Struct('<IHIHIHIHddI')
+# Nessuna chiave UTF-8 contiene il byte 0xFF: prefisso + 0xFF è un limite superiore
+PREFIX_END = b'\xff'
+# Record esaminati al massimo per una ricerca per prefisso prima dell'ordinamento per popolazione
+SCAN_LIMIT = 256
+# Prefissi già chiesti all'API remota ricordati da ogni processo (per non ripetere la chiamata
+# quando l'API non ha restituito città nuove)
+MAX_ASKED_PREFIXES = 10000
+
+
+def normalize(name):
+    return ' '.join(name.lower().split())
+
+
+def _record(key, name, state, country, lat, lon, population=0):
+    return (normalize(key), name, state or '', country or '', float(lat), float(lon), int(population or 0))
+
+
+def _as_result(record):
+    # Stessa forma delle risposte di /geo/1.0/direct usate dall'app
+    _, name, state, country, lat, lon, _ = record
+    return {'name': name, 'lat': lat, 'lon': lon, 'country': country, 'state': state}
+
+
+def _identity(result):
+    # Due risultati sono la stessa città se coincidono nome, regione e paese (come nei suggerimenti);
+    # le coordinate del gazetteer e dell'API remota possono differire di qualche centesimo
+    return normalize(result['name']), result.get('state') or '', result.get('country') or ''
+
+
+def write_table(path, records):
+    # Scrive il file binario in modo atomico (file temporaneo + rename)
+    records = sorted(set(records), key=lambda record: (record[0].encode('utf-8'), -record[6]))
+    blob = bytearray()
+    offsets = {}
+
+    def intern(text):
+        data = text.encode('utf-8')
+        if data not in offsets:
+            offsets[data] = len(blob)
+            blob.extend(data)
+        return offsets[data], len(data)
+
+    packed = bytearray()
+    for key, name, state, country, lat, lon, population in records:
+        fields = []
+        for text in (key, name, state, country):
+            fields.extend(intern(text))
+        packed.extend(RECORD.pack(*fields, lat, lon, population))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    handle, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(handle, 'wb') as output:
+        output.write(HEADER.pack(MAGIC, VERSION, len(records)))
+        output.write(packed)
+        output.write(blob)
+    os.replace(temp_path, path)
+    return len(records)
+
+
+def read_csv(path):
+    # CSV con intestazione name,state,country,lat,lon[,population]
+    with open(path, encoding='utf-8', newline='') as source:
+        for row in csv.DictReader(source):
+            yield _record(row['name'], row['name'], row.get('state'), row.get('country'),
+                          row['lat'], row['lon'], row.get('population'))
+
+
+def read_geonames(path, min_population=0):
+    # File "cities" di GeoNames (TSV): nome, nome ASCII come chiave alternativa, codice regione
+    with open(path, encoding='utf-8') as source:
+        for line in source:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 15:
+                continue
+            population = int(fields[14] or 0)
+            if population < min_population:
+                continue
+            name, ascii_name = fields[1], fields[2]
+            values = (name, fields[10], fields[8], fields[4], fields[5], population)
+            yield _record(name, *values)
+            if ascii_name and normalize(ascii_name) != normalize(name):
+                yield _record(ascii_name, *values)
+
+
+# Gazetteer locale delle città: tabella binaria mappata in memoria (mmap) più una parte
+# aggiuntiva in memoria con le città imparate dall'API remota, salvate in un journal JSONL.
+# La parte aggiuntiva (e quindi il journal) contiene al massimo max_learned città: oltre il
+# limite le città nuove non vengono più imparate finché il comando di compattazione non
+# unisce il journal alla tabella.
+class Gazetteer:
+    def __init__(self, path, journal_path=None, max_learned=5000, min_suggestions=1):
+        self.path = path
+        self.journal_path = journal_path or path + '.journal'
+        self.max_learned = max_learned
+        # Sotto questo numero di suggerimenti locali si interpella l'API remota (una volta per prefisso)
+        self.min_suggestions = min_suggestions
+        self._lock = threading.Lock()
+        self._mmap = None
+        self._count = 0
+        self._strings_offset = 0
+        # Parte aggiuntiva: lista ordinata di (chiave in byte, record)
+        self._overlay = []
+        self._overlay_set = set()
+        self._journal_offset = 0
+        self._asked = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.learned = 0
+        self.skipped = 0
+        self.load()
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as table:
+                mapped = mmap.mmap(table.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, count = HEADER.unpack_from(mapped, 0)
+            if magic != MAGIC or version != VERSION:
+                mapped.close()
+                raise ValueError(f'{self.path} non è un gazetteer valido (versione {VERSION})')
+            self._mmap = mapped
+            self._count = count
+            self._strings_offset = HEADER.size + count * RECORD.size
+        with self._lock:
+            self._overlay = []
+            self._overlay_set = set()
+            self._journal_offset = 0
+        self.refresh_journal()
+
+    # --- tabella mappata ---
+
+    def _key_at(self, index):
+        key_offset, key_length = struct.unpack_from('<IH', self._mmap, HEADER.size + index * RECORD.size)
+        start = self._strings_offset + key_offset
+        return self._mmap[start:start + key_length]
+
+    def _record_at(self, index):
+        fields = RECORD.unpack_from(self._mmap, HEADER.size + index * RECORD.size)
+        texts = []
+        for position in range(0, 8, 2):
+            start = self._strings_offset + fields[position]
+            texts.append(self._mmap[start:start + fields[position + 1]].decode('utf-8'))
+        return (*texts, *fields[8:])
+
+    def _bisect(self, key):
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key_at(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _table_range(self, low_key, high_key):
+        if self._mmap is None:
+            return range(0)
+        return range(self._bisect(low_key), self._bisect(high_key))
+
+    def _candidates(self, low_key, high_key):
+        indexes = self._table_range(low_key, high_key)
+        records = [self._record_at(index) for index in indexes[:SCAN_LIMIT]]
+        with self._lock:
+            start = bisect_left(self._overlay, (low_key,))
+            end = bisect_left(self._overlay, (high_key,))
+            records.extend(record for _, record in self._overlay[start:end][:SCAN_LIMIT])
+        return records
+
+    # --- ricerca ---
+
+    def _find(self, low_key, high_key, key, limit):
+        results = self._results(self._candidates(low_key, high_key), key, limit)
+        # Prima di ricorrere all'API remota controlla se un altro processo ha imparato la città
+        if len(results) < limit and self.refresh_journal():
+            results = self._results(self._candidates(low_key, high_key), key, limit)
+        return results
+
+    def _results(self, records, key, limit):
+        # Prima le corrispondenze esatte, poi le città più popolose; senza duplicati
+        records.sort(key=lambda record: (record[0] != key, -record[6]))
+        results = []
+        seen = set()
+        for record in records:
+            result = _as_result(record)
+            identity = _identity(result)
+            if identity in seen:
+                continue
+            seen.add(identity)
+            results.append(result)
+            if len(results) == limit:
+                break
+        return results
+
+    def needs_remote(self, query, results):
+        # Suggerimenti: i risultati locali bastano se sono almeno min_suggestions (di norma
+        # basta uno); altrimenti si interpella l'API una sola volta per prefisso e solo se non
+        # ci sono già città imparate con quel prefisso
+        key = normalize(query)
+        if len(results) >= self.min_suggestions or self._overlay_has_prefix(key):
+            self.hits += 1
+            return False
+        with self._lock:
+            if key in self._asked:
+                self._asked.move_to_end(key)
+                asked = True
+            else:
+                self._asked[key] = True
+                while len(self._asked) > MAX_ASKED_PREFIXES:
+                    self._asked.popitem(last=False)
+                asked = False
+        if asked:
+            self.hits += 1
+            return False
+        self.misses += 1
+        return True
+
+    def _overlay_has_prefix(self, key):
+        encoded = key.encode('utf-8')
+        with self._lock:
+            index = bisect_left(self._overlay, (encoded,))
+            return index < len(self._overlay) and self._overlay[index][0].startswith(encoded)
+
+    def merge(self, query, results, remote, limit):
+        # Unisce ai risultati locali quelli dell'API remota, senza duplicati e con prima le
+        # corrispondenze esatte, e aggiunge al gazetteer le città remote non ancora note
+        self.learn(query, remote)
+        key = normalize(query)
+        merged = []
+        seen = set()
+        for result in list(results) + list(remote):
+            identity = _identity(result)
+            if identity not in seen:
+                seen.add(identity)
+                merged.append(result)
+        merged.sort(key=lambda result: normalize(result['name']) != key)
+        return merged[:limit]
+
+    def search(self, prefix, limit=5):
+        # Città il cui nome inizia con prefix (suggerimenti)
+        key = normalize(prefix)
+        encoded = key.encode('utf-8')
+        return self._find(encoded, encoded + PREFIX_END, key, limit)
+
+    def lookup(self, name, limit=1):
+        # Città con esattamente questo nome (geocoding per le previsioni)
+        key = normalize(name)
+        encoded = key.encode('utf-8')
+        results = self._find(encoded, encoded + b'\x00', key, limit)
+        if results:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return results
+
+    # --- apprendimento dall'API remota ---
+
+    def _add_overlay(self, record):
+        # Da chiamare con il lock acquisito; False se il record era già presente o se la parte
+        # aggiuntiva ha raggiunto max_learned
+        if record in self._overlay_set:
+            return False
+        if len(self._overlay) >= self.max_learned:
+            self.skipped += 1
+            return False
+        self._overlay_set.add(record)
+        insort(self._overlay, (record[0].encode('utf-8'), record))
+        return True
+
+    def learn(self, query, results, alias=False):
+        # Aggiunge le città restituite dall'API remota; con alias=True la prima è registrata
+        # anche sotto il testo cercato (es. "Rome" -> "Roma"). Restituisce results.
+        records = [_record(result['name'], result['name'], result.get('state'), result.get('country'),
+                           result['lat'], result['lon']) for result in results]
+        if alias and records and normalize(query) != records[0][0]:
+            records.append((normalize(query),) + records[0][1:])
+
+        # Le righe scritte dagli altri processi contano per il limite max_learned
+        self.refresh_journal()
+        new_records = []
+        with self._lock:
+            for record in records:
+                if self._table_has(record):
+                    continue
+                if self._add_overlay(record):
+                    new_records.append(record)
+            if new_records:
+                lines = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in new_records)
+                # Scrittura in append: più processi possono aggiungere righe allo stesso journal
+                with open(self.journal_path, 'a', encoding='utf-8') as journal:
+                    journal.write(lines)
+                self.learned += len(new_records)
+        return results
+
+    def _table_has(self, record):
+        encoded = record[0].encode('utf-8')
+        for index in self._table_range(encoded, encoded + b'\x00'):
+            if self._record_at(index)[:4] == record[:4]:
+                return True
+        return False
+
+    def refresh_journal(self):
+        # Legge le righe aggiunte al journal (anche da altri processi) dopo l'ultima lettura;
+        # True se ci sono righe nuove
+        try:
+            size = os.path.getsize(self.journal_path)
+        except OSError:
+            return False
+        with self._lock:
+            if size < self._journal_offset:
+                # Journal svuotato da una compattazione
+                self._journal_offset = 0
+            if size == self._journal_offset:
+                return False
+            with open(self.journal_path, 'rb') as journal:
+                journal.seek(self._journal_offset)
+                data = journal.read()
+            # Una riga incompleta (scrittura in corso) viene letta la volta successiva
+            complete = data[:data.rfind(b'\n') + 1]
+            self._journal_offset += len(complete)
+            for line in complete.splitlines():
+                if line.strip():
+                    self._add_overlay(tuple(json.loads(line)))
+            return bool(complete)
+
+    # --- costruzione e compattazione ---
+
+    def all_records(self):
+        records = [self._record_at(index) for index in range(self._count)] if self._mmap is not None else []
+        with self._lock:
+            records.extend(record for _, record in self._overlay)
+        return records
+
+    def rebuild(self, records=None):
+        # Riscrive la tabella con records (oppure tabella attuale + journal) e svuota il journal
+        self.refresh_journal()
+        if records is None:
+            records = self.all_records()
+        else:
+            with self._lock:
+                records = list(records) + [record for _, record in self._overlay]
+        count = write_table(self.path, records)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self.load()
+        return count
+
+    def stats(self):
+        with self._lock:
+            return {'table': self._count, 'overlay': len(self._overlay), 'learned': self.learned,
+                    'skipped': self.skipped, 'hits': self.hits, 'misses': self.misses}
+
+    def __len__(self):
+        return self._count + len(self._overlay)
@@ -0,0 +1,34 @@
+# Configurazione di gunicorn per la produzione (prefork, un processo per core):
+#   gunicorn -c gunicorn.conf.py
+import multiprocessing
+import os
+
+wsgi_app = 'wsgi:app'
+bind = os.getenv('BIND', '127.0.0.1:8000')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+# Thread per worker: le richieste restano in attesa di OpenWeatherMap senza bloccare il processo
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+timeout = 30
+graceful_timeout = 30
+# L'app (migrazioni comprese) viene caricata una sola volta nel master e poi condivisa con fork
+preload_app = True
+# Riavvia periodicamente i worker per contenere la crescita della memoria
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '10000'))
+max_requests_jitter = max_requests // 10
+
+# Stato condiviso tra i worker (cache, sessioni dei quiz, eventi di invalidazione)
+os.environ.setdefault('SHARED_STATE_PATH',
+                      os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'shared_state.db'))
+
+
+def post_fork(server, worker):
+    # Ricrea connessioni e thread nel worker e ricarica lo stato dal database
+    import sito
+    sito.init_worker()
+
+
+def worker_exit(server, worker):
+    # Salva le attività ancora in coda prima dell'uscita del worker
+    import sito
+    sito.activity_writer.stop()
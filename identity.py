@@ -0,0 +1,59 @@
+import threading
+import time
+from collections import OrderedDict
+
+from flask_login import UserMixin
+
+
+# Copia in sola lettura dei dati dell'utente usata come current_user
+# nelle richieste autenticate, senza sessione SQLAlchemy associata
+class CachedUser(UserMixin):
+    def __init__(self, user):
+        self.id = user.id
+        self.nickname = user.nickname
+        self.email = user.email
+        self.total_score = user.total_score
+        self.created_at = user.created_at
+        self.last_activity_at = user.last_activity_at
+
+
+# Cache delle identità per user_loader con scadenza (TTL) e numero massimo di voci
+class IdentityCache:
+    def __init__(self, ttl=60, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[1] < time.monotonic():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, user):
+        cached = CachedUser(user)
+        with self._lock:
+            self._entries[cached.id] = (cached, time.monotonic() + self.ttl)
+            self._entries.move_to_end(cached.id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return cached
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,53 @@
+from bisect import bisect_left, insort
+from threading import Lock
+
+
+# Classifica in memoria ordinata per (punteggio decrescente, id crescente)
+class Leaderboard:
+    def __init__(self):
+        # Le chiavi sono (-total_score, user_id) così l'ordine naturale della lista
+        # coincide con l'ordine della classifica
+        self._keys = []
+        self._scores = {}
+        self._lock = Lock()
+
+    def load(self, rows):
+        # Ricostruisce l'indice da coppie (user_id, total_score)
+        scores = {user_id: score or 0 for user_id, score in rows}
+        keys = sorted((-score, user_id) for user_id, score in scores.items())
+        with self._lock:
+            self._scores = scores
+            self._keys = keys
+
+    def update(self, user_id, total_score):
+        # Inserisce o aggiorna il punteggio di un utente
+        total_score = total_score or 0
+        with self._lock:
+            old_score = self._scores.get(user_id)
+            if old_score == total_score:
+                return
+            if old_score is not None:
+                index = bisect_left(self._keys, (-old_score, user_id))
+                del self._keys[index]
+            self._scores[user_id] = total_score
+            insort(self._keys, (-total_score, user_id))
+
+    def rank(self, user_id):
+        # Posizione in classifica (a partire da 1) o None se l'utente non è presente
+        with self._lock:
+            score = self._scores.get(user_id)
+            if score is None:
+                return None
+            return bisect_left(self._keys, (-score, user_id)) + 1
+
+    def score(self, user_id):
+        with self._lock:
+            return self._scores.get(user_id)
+
+    def top(self, n):
+        # Primi n utenti come lista di (user_id, total_score)
+        with self._lock:
+            return [(user_id, -negative_score) for negative_score, user_id in self._keys[:n]]
+
+    def __len__(self):
+        return len(self._keys)
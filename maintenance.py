@@ -0,0 +1,86 @@
+import gzip
+import json
+import os
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+
+# Sposta in archivio le attività più vecchie di older_than_days giorni.
+# Per ogni blocco di righe: le scrive nell'archivio gzip JSONL, aggiorna i riepiloghi
+# giornalieri e cancella le righe nella stessa transazione, così ogni riga viene
+# conteggiata una sola volta anche se il comando viene interrotto e rilanciato.
+def archive_activities(db, activity_model, daily_model, older_than_days, archive_dir,
+                       chunk_size=1000, pause=0.05, log=print):
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    columns = activity_model.__table__.c
+    last_id = 0
+    archived = 0
+    archive = None
+    archive_path = None
+
+    try:
+        while True:
+            # Lettura a blocchi tramite keyset sull'id: nessun OFFSET e memoria costante
+            rows = db.session.execute(
+                db.select(columns.id, columns.user_id, columns.activity_type, columns.description,
+                          columns.city, columns.created_at)
+                .where(columns.created_at < cutoff, columns.id > last_id)
+                .order_by(columns.id)
+                .limit(chunk_size)
+            ).all()
+            if not rows:
+                break
+
+            if archive is None:
+                # Il file viene creato solo se c'è almeno una riga da archiviare
+                os.makedirs(archive_dir, exist_ok=True)
+                archive_path = os.path.join(
+                    archive_dir, f"user_activity-{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}.jsonl.gz")
+                archive = gzip.open(archive_path, 'xt', encoding='utf-8')
+
+            rollup = Counter()
+            for row in rows:
+                archive.write(json.dumps({
+                    'id': row.id,
+                    'user_id': row.user_id,
+                    'activity_type': row.activity_type,
+                    'description': row.description,
+                    'city': row.city,
+                    'created_at': row.created_at.isoformat()
+                }, ensure_ascii=False) + '\n')
+                rollup[(row.user_id, row.created_at.date(), row.activity_type)] += 1
+            archive.flush()
+
+            _merge_rollup(db, daily_model, rollup)
+            db.session.execute(db.delete(activity_model).where(columns.id.in_([row.id for row in rows])))
+            db.session.commit()
+
+            last_id = rows[-1].id
+            archived += len(rows)
+            log(f'Archiviate {archived} attività (fino all\'id {last_id})')
+
+            # Lascia libero il lock di scrittura per le richieste dell'app
+            if pause:
+                time.sleep(pause)
+    finally:
+        if archive is not None:
+            archive.close()
+
+    return archived, archive_path
+
+
+def _merge_rollup(db, daily_model, rollup):
+    if not rollup:
+        return
+    statement = sqlite_insert(daily_model).values([
+        {'user_id': user_id, 'day': day, 'activity_type': activity_type, 'count': count}
+        for (user_id, day, activity_type), count in rollup.items()
+    ])
+    statement = statement.on_conflict_do_update(
+        index_elements=['user_id', 'day', 'activity_type'],
+        set_={'count': daily_model.__table__.c.count + statement.excluded.count}
+    )
+    db.session.execute(statement)
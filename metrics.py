@@ -0,0 +1,204 @@
+import cProfile
+import io
+import pstats
+import random
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, g, has_app_context, request
+from sqlalchemy import event
+
+# Limiti dei bucket (in secondi) per le latenze delle richieste e delle chiamate esterne
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Limiti dei bucket per il numero di query SQL per richiesta
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+# Istogramma a bucket fissi: un array di contatori, nessuna allocazione per osservazione
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'total', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+
+# Raccolta delle metriche dell'app, esposte in formato testo Prometheus su /metrics
+class Metrics:
+    def __init__(self, app=None, db=None):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._help = {}
+        # Funzioni che restituiscono valori istantanei (cache, code, ...) al momento della lettura
+        self._collectors = []
+        self.slow_request_seconds = None
+        self.profile_sample_rate = 0.0
+        self.logger = None
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db=None):
+        slow_ms = app.config.get('SLOW_REQUEST_MS')
+        self.slow_request_seconds = slow_ms / 1000 if slow_ms else None
+        self.profile_sample_rate = app.config.get('PROFILE_SAMPLE_RATE', 0.0)
+        self.logger = app.logger
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+
+        if db is not None:
+            with app.app_context():
+                engine = db.engine
+            event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    # --- registrazione dei valori ---
+
+    def observe(self, name, labels, value, buckets=LATENCY_BUCKETS, help_text=None):
+        key = (name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+                if help_text:
+                    self._help.setdefault(name, help_text)
+            histogram.observe(value)
+
+    def increment(self, name, labels=(), amount=1, help_text=None):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+            if help_text:
+                self._help.setdefault(name, help_text)
+
+    def add_collector(self, collector):
+        # collector() restituisce una lista di (nome, etichette, valore)
+        self._collectors.append(collector)
+
+    def observe_upstream(self, service, endpoint, seconds, ok):
+        # Latenza delle chiamate HTTP verso servizi esterni (es. OpenWeatherMap)
+        labels = (('service', service), ('endpoint', endpoint), ('ok', 'true' if ok else 'false'))
+        self.observe('kodland_upstream_request_seconds', labels, seconds,
+                     help_text='Latenza delle chiamate HTTP verso servizi esterni')
+
+    # --- hook di Flask ---
+
+    def _before_request(self):
+        g.metrics_start = time.perf_counter()
+        g.metrics_sql_count = 0
+        g.metrics_sql_seconds = 0.0
+        g.metrics_profiler = None
+        if self.profile_sample_rate and random.random() < self.profile_sample_rate:
+            g.metrics_profiler = cProfile.Profile()
+            g.metrics_profiler.enable()
+
+    def _after_request(self, response):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        profiler = g.pop('metrics_profiler', None)
+        if profiler is not None:
+            profiler.disable()
+
+        endpoint = request.endpoint or 'unknown'
+        labels = (('endpoint', endpoint), ('method', request.method))
+        self.observe('kodland_request_seconds', labels + (('status', str(response.status_code)),), elapsed,
+                     help_text='Durata delle richieste HTTP per endpoint')
+        self.observe('kodland_request_sql_queries', labels, g.metrics_sql_count, buckets=QUERY_COUNT_BUCKETS,
+                     help_text='Numero di query SQL per richiesta')
+        self.observe('kodland_request_sql_seconds', labels, g.metrics_sql_seconds,
+                     help_text='Tempo speso in query SQL per richiesta')
+
+        if self.slow_request_seconds is not None and elapsed >= self.slow_request_seconds:
+            self.increment('kodland_slow_requests_total', (('endpoint', endpoint),),
+                           help_text='Richieste più lente della soglia SLOW_REQUEST_MS')
+            message = (f'Richiesta lenta {request.method} {request.path} ({endpoint}): '
+                       f'{elapsed * 1000:.1f} ms, {g.metrics_sql_count} query SQL '
+                       f'({g.metrics_sql_seconds * 1000:.1f} ms)')
+            if profiler is not None:
+                output = io.StringIO()
+                pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(20)
+                message += '\n' + output.getvalue()
+            self.logger.warning(message)
+
+        return response
+
+    # --- eventi di SQLAlchemy ---
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['metrics_query_start'].pop()
+        if has_app_context() and 'metrics_sql_count' in g:
+            g.metrics_sql_count += 1
+            g.metrics_sql_seconds += elapsed
+        else:
+            # Query fuori da una richiesta (thread di scrittura delle attività, comandi CLI)
+            self.increment('kodland_background_sql_queries_total',
+                           help_text='Query SQL eseguite fuori dalle richieste HTTP')
+
+    # --- esportazione ---
+
+    def render(self):
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+            histograms = [(key, list(h.counts), h.total, h.count, h.bounds) for key, h in histograms]
+            counters = sorted(self._counters.items())
+            help_texts = dict(self._help)
+
+        described = set()
+
+        def describe(name, kind):
+            if name not in described:
+                described.add(name)
+                if name in help_texts:
+                    lines.append(f'# HELP {name} {help_texts[name]}')
+                lines.append(f'# TYPE {name} {kind}')
+
+        for (name, labels), counts, total, count, bounds in histograms:
+            describe(name, 'histogram')
+            cumulative = 0
+            for bound, bucket_count in zip(bounds, counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", bound),))} {cumulative}')
+            lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {count}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {total}')
+            lines.append(f'{name}_count{_format_labels(labels)} {count}')
+
+        for (name, labels), value in counters:
+            describe(name, 'counter')
+            lines.append(f'{name}{_format_labels(labels)} {value}')
+
+        # I campioni della stessa metrica devono essere contigui nel formato Prometheus
+        gauges = {}
+        for collector in self._collectors:
+            for name, labels, value in collector():
+                gauges.setdefault(name, []).append((labels, value))
+        for name, samples in gauges.items():
+            describe(name, 'gauge')
+            for labels, value in samples:
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+    def metrics_view(self):
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,46 @@
+from bisect import bisect_left, insort
+from threading import Lock
+
+
+# Indice in memoria dei nickname registrati (confronto senza distinzione tra maiuscole e minuscole)
+class NicknameIndex:
+    def __init__(self):
+        # Insieme per la verifica di disponibilità in O(1)
+        self._taken = set()
+        # Array ordinato per le ricerche per prefisso con bisect
+        self._sorted = []
+        self._lock = Lock()
+
+    @staticmethod
+    def normalize(nickname):
+        return nickname.strip().lower()
+
+    def load(self, nicknames):
+        taken = {self.normalize(nickname) for nickname in nicknames}
+        with self._lock:
+            self._taken = taken
+            self._sorted = sorted(taken)
+
+    def add(self, nickname):
+        key = self.normalize(nickname)
+        with self._lock:
+            if key not in self._taken:
+                self._taken.add(key)
+                insort(self._sorted, key)
+
+    def is_taken(self, nickname):
+        return self.normalize(nickname) in self._taken
+
+    def with_prefix(self, prefix, limit=None):
+        # Nickname (normalizzati) che iniziano con il prefisso indicato, in ordine alfabetico
+        prefix = self.normalize(prefix)
+        with self._lock:
+            start = bisect_left(self._sorted, prefix)
+            # '\U0010ffff' è maggiore di qualsiasi carattere: delimita la fine del prefisso
+            end = bisect_left(self._sorted, prefix + '\U0010ffff', start)
+            if limit is not None:
+                end = min(end, start + limit)
+            return self._sorted[start:end]
+
+    def __len__(self):
+        return len(self._taken)
@@ -0,0 +1,171 @@
+import gzip
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+
+from werkzeug.http import http_date
+
+from flask import Response, request, session
+from flask_login import current_user
+
+try:
+    import brotli
+except ImportError:  # brotli è opzionale: senza, si usa solo gzip
+    brotli = None
+
+
+# Pagina (o frammento) già renderizzata, con le versioni compresse e gli header
+# calcolati una sola volta
+class CachedPage:
+    __slots__ = ('bodies', 'etag', 'last_modified', 'last_modified_header', 'generations', 'expires_at')
+
+    def __init__(self, body, generations, expires_at, compress):
+        etag = hashlib.sha1(body).hexdigest()
+        # codifica -> (corpo, ETag tra virgolette); l'ETag cambia con la codifica
+        self.bodies = {None: (body, f'"{etag}"')}
+        if compress:
+            self.bodies['gzip'] = (gzip.compress(body, 9, mtime=0), f'"{etag}-gzip"')
+            if brotli is not None:
+                self.bodies['br'] = (brotli.compress(body), f'"{etag}-br"')
+        self.etag = etag
+        self.last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+        self.last_modified_header = http_date(self.last_modified)
+        self.generations = generations
+        self.expires_at = expires_at
+
+    @property
+    def body(self):
+        return self.bodies[None][0]
+
+
+def default_variant():
+    # Le pagine cambiano solo tra visitatore anonimo e utente autenticato (nickname nella barra)
+    return current_user.get_id() if current_user.is_authenticated else None
+
+
+# Cache LRU delle risposte HTML renderizzate.
+# Le voci appartengono a dei "tag" (es. 'scoreboard'): invalidate(tag) incrementa la
+# generazione del tag e rende vecchie tutte le voci create prima.
+class PageCache:
+    def __init__(self, max_entries=2000, min_compress_size=512):
+        self.max_entries = max_entries
+        self.min_compress_size = min_compress_size
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    def generations(self, tags):
+        with self._lock:
+            return tuple((tag, self._generations.get(tag, 0)) for tag in tags)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stale = entry.expires_at is not None and entry.expires_at < time.monotonic()
+                if stale or any(self._generations.get(tag, 0) != generation
+                                for tag, generation in entry.generations):
+                    del self._entries[key]
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, text, generations=(), ttl=None, compress=True):
+        # generations va letto prima del rendering: un'invalidazione durante il rendering
+        # rende subito vecchia la voce appena creata
+        body = text.encode('utf-8')
+        expires_at = time.monotonic() + ttl if ttl else None
+        entry = CachedPage(body, generations, expires_at, compress and len(body) >= self.min_compress_size)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, tag):
+        with self._lock:
+            self._generations[tag] = self._generations.get(tag, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def fragment(self, key, render, tags=(), ttl=None):
+        # Frammento HTML condiviso da tutti i visitatori (non compresso)
+        entry = self.get(('fragment', key))
+        if entry is None:
+            generations = self.generations(tags)
+            entry = self.put(('fragment', key), render(), generations, ttl, compress=False)
+        return entry.body.decode('utf-8')
+
+    def cached(self, tags=(), ttl=None, variant=default_variant, flashes=False):
+        # Decoratore per le view GET che restituiscono l'HTML di render_template.
+        # Le richieste con query string non usano la cache; con flashes=True (template che
+        # mostra i messaggi flash) nemmeno quelle con messaggi in sospeso.
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if request.method != 'GET' or request.args or (flashes and session.get('_flashes')):
+                    self.bypassed += 1
+                    return view(*args, **kwargs)
+
+                key = (request.endpoint, variant(), tuple(sorted(kwargs.items())))
+                entry = self.get(key)
+                if entry is None:
+                    generations = self.generations(tags)
+                    result = view(*args, **kwargs)
+                    if not isinstance(result, str):
+                        return result
+                    entry = self.put(key, result, generations, ttl)
+                return self.respond(entry)
+            return wrapper
+        return decorator
+
+    def respond(self, entry):
+        # Sceglie la codifica precompressa accettata dal client e risponde 304 se non è cambiata
+        encoding = None
+        if len(entry.bodies) > 1:
+            accepted = request.accept_encodings
+            if 'br' in entry.bodies and accepted['br']:
+                encoding = 'br'
+            elif accepted['gzip']:
+                encoding = 'gzip'
+        body, etag = entry.bodies[encoding]
+
+        headers = [
+            ('ETag', etag),
+            ('Last-Modified', entry.last_modified_header),
+            ('Cache-Control', 'private, no-cache'),
+            ('Vary', 'Accept-Encoding, Cookie')
+        ]
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match is not None:
+            not_modified = etag in if_none_match or if_none_match.strip() == '*'
+        else:
+            if_modified_since = request.if_modified_since
+            not_modified = if_modified_since is not None and if_modified_since >= entry.last_modified
+        if not_modified:
+            return Response(status=304, headers=headers)
+
+        if encoding:
+            headers.append(('Content-Encoding', encoding))
+        return Response(body, headers=headers, content_type='text/html; charset=utf-8')
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                    'bypassed': self.bypassed}
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,62 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+try:
+    from argon2 import PasswordHasher
+    from argon2.exceptions import InvalidHashError, VerificationError
+except ImportError:  # argon2-cffi è opzionale
+    PasswordHasher = None
+
+
+# Politica di hashing delle password configurabile.
+# method accetta i metodi di werkzeug ('scrypt:32768:8:1', 'pbkdf2:sha256:600000', ...)
+# oppure 'argon2' / 'argon2:<time_cost>:<memory_cost_kib>:<parallelism>' se argon2-cffi è installato.
+class PasswordPolicy:
+    def __init__(self, method='scrypt:32768:8:1', workers=2):
+        self.method = method
+        self._argon2 = None
+
+        if method.startswith('argon2'):
+            if PasswordHasher is None:
+                raise RuntimeError('PASSWORD_HASH_METHOD=argon2 richiede il pacchetto argon2-cffi')
+            params = [int(value) for value in method.split(':')[1:]]
+            names = ('time_cost', 'memory_cost', 'parallelism')
+            self._argon2 = PasswordHasher(**dict(zip(names, params)))
+            self._werkzeug_prefix = None
+        else:
+            # Prefisso completo (con i parametri predefiniti di werkzeug) degli hash prodotti
+            self._werkzeug_prefix = generate_password_hash('', method=method).split('$', 1)[0]
+
+        # Pool limitato: i login simultanei non occupano più di `workers` core per l'hashing
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+
+    def after_fork(self):
+        # I thread del pool non vengono copiati nel processo figlio
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hash')
+
+    def hash(self, password):
+        if self._argon2 is not None:
+            return self._argon2.hash(password)
+        return generate_password_hash(password, method=self.method)
+
+    def _verify(self, password_hash, password):
+        if password_hash.startswith('$argon2'):
+            if PasswordHasher is None:
+                return False
+            try:
+                return (self._argon2 or PasswordHasher()).verify(password_hash, password)
+            except (VerificationError, InvalidHashError):
+                return False
+        return check_password_hash(password_hash, password)
+
+    def verify(self, password_hash, password):
+        # La verifica gira nel pool dedicato; hashlib rilascia il GIL durante il calcolo
+        return self._executor.submit(self._verify, password_hash, password).result()
+
+    def needs_rehash(self, password_hash):
+        # True se l'hash è stato creato con un metodo o parametri diversi da quelli attuali
+        if self._argon2 is not None:
+            return not password_hash.startswith('$argon2') or self._argon2.check_needs_rehash(password_hash)
+        return password_hash.split('$', 1)[0] != self._werkzeug_prefix
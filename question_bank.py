@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+
+
+# Istantanea immutabile della banca domande con le risposte JSON già serializzate.
+# I frammenti pubblici contengono solo id, testo e opzioni: l'indice della risposta
+# corretta resta sul server e serve solo per la correzione.
+class _BankSnapshot:
+    __slots__ = ('questions', 'fragments', 'full_body', 'etag', 'loaded_at')
+
+    def __init__(self, questions):
+        self.questions = tuple(questions)
+        self.fragments = tuple(self.serialize(question_id, question)
+                               for question_id, question in enumerate(self.questions))
+        self.full_body = b'[' + b','.join(self.fragments) + b']'
+        self.etag = hashlib.sha1(self.full_body).hexdigest()
+        self.loaded_at = time.time()
+
+    @staticmethod
+    def serialize(question_id, question):
+        public = {'id': question_id, 'question': question['question'], 'options': question['options']}
+        return json.dumps(public, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+    def correct_answer(self, question_id):
+        return self.questions[question_id]['correct']
+
+
+# Banca delle domande del quiz: caricata una volta, serializzata in anticipo e
+# ricaricabile a caldo quando il file sorgente cambia
+class QuestionBank:
+    def __init__(self, questions=None, path=None, check_interval=2.0):
+        self.default_questions = questions or []
+        self.path = path
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._mtime = None
+        # Data di modifica dell'ultimo file non valido: non viene riletto finché non cambia
+        self._bad_mtime = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.load()
+
+    def _read_source(self):
+        if self.path and os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as source:
+                questions = json.load(source)
+            return questions, os.path.getmtime(self.path)
+        return self.default_questions, None
+
+    @staticmethod
+    def validate(questions):
+        if not isinstance(questions, list) or not questions:
+            raise ValueError('La banca domande deve essere una lista non vuota')
+        for index, question in enumerate(questions):
+            if not isinstance(question, dict):
+                raise ValueError(f'Domanda {index} non valida: deve essere un oggetto')
+            if not isinstance(question.get('question'), str) or not question['question']:
+                raise ValueError(f'Domanda {index} non valida: servono "question" e "options"')
+            if not isinstance(question.get('options'), list) or not question['options']:
+                raise ValueError(f'Domanda {index} non valida: servono "question" e "options"')
+            correct = question.get('correct')
+            # bool è una sottoclasse di int, ma true/false non sono indici validi
+            if not isinstance(correct, int) or isinstance(correct, bool):
+                raise ValueError(f'Domanda {index} non valida: "correct" deve essere un intero')
+            if not 0 <= correct < len(question['options']):
+                raise ValueError(f'Domanda {index} non valida: indice "correct" fuori intervallo')
+
+    def load(self):
+        # Legge e valida la sorgente, poi sostituisce l'istantanea in un colpo solo
+        questions, mtime = self._read_source()
+        self.validate(questions)
+        snapshot = _BankSnapshot(questions)
+        with self._lock:
+            self._snapshot = snapshot
+            self._mtime = mtime
+            self._next_check = time.monotonic() + self.check_interval
+            self.loads += 1
+        return snapshot
+
+    def reload_if_changed(self):
+        # Controlla la data di modifica del file al massimo ogni check_interval secondi
+        if not self.path or time.monotonic() < self._next_check:
+            return False
+        with self._lock:
+            self._next_check = time.monotonic() + self.check_interval
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return False
+        if mtime == self._mtime or mtime == self._bad_mtime:
+            return False
+        try:
+            self.load()
+        except (ValueError, TypeError, AttributeError, OSError):
+            # File non valido o non leggibile: resta in uso la versione precedente e il file
+            # viene riletto solo dopo una nuova modifica
+            self._bad_mtime = mtime
+            return False
+        return True
+
+    @property
+    def snapshot(self):
+        self.reload_if_changed()
+        return self._snapshot
+
+    def draw(self, count):
+        # Estrae `count` domande casuali: restituisce l'istantanea usata, gli id estratti
+        # e il corpo JSON ottenuto unendo i frammenti già serializzati
+        snapshot = self.snapshot
+        question_ids = random.sample(range(len(snapshot.fragments)), min(count, len(snapshot.fragments)))
+        body = b'[' + b','.join([snapshot.fragments[question_id] for question_id in question_ids]) + b']'
+        return snapshot, question_ids, body
+
+    def full_json(self):
+        # Corpo JSON dell'intera banca con il relativo ETag
+        snapshot = self.snapshot
+        return snapshot.full_body, snapshot.etag
+
+    def __len__(self):
+        return len(self._snapshot.questions)
@@ -0,0 +1,126 @@
+import secrets
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+
+# Partita in corso: utente, id delle domande estratte e relative risposte corrette
+# (autosufficiente, così può essere salvata anche nella cache condivisa tra processi)
+class QuizSession:
+    __slots__ = ('session_id', 'user_id', 'question_ids', 'answer_key', 'expires_at')
+
+    def __init__(self, session_id, user_id, question_ids, answer_key, expires_at):
+        self.session_id = session_id
+        self.user_id = user_id
+        # array compatti di interi senza segno (16 e 8 bit) invece di liste di oggetti int
+        self.question_ids = array('H', question_ids)
+        self.answer_key = array('B', answer_key)
+        # Orario assoluto (time.time) perché la sessione può essere letta da un altro processo
+        self.expires_at = expires_at
+
+
+def _matches(session, session_id):
+    # Confronto a tempo costante (sui byte: session_id arriva dal client e può non essere ASCII)
+    return secrets.compare_digest(session.session_id.encode('utf-8'), session_id.encode('utf-8'))
+
+
+# Archivio delle partite con scadenza (TTL): al massimo una partita attiva per utente (una nuova
+# partita sostituisce la precedente), più un limite complessivo di sicurezza `max_sessions`.
+# Di default in memoria; con `cache` (shared_state.SharedCache) condiviso tra i processi worker.
+class QuizSessionStore:
+    def __init__(self, ttl=7200, max_sessions=20000, cache=None):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.cache = cache
+        # user_id -> QuizSession, in ordine di creazione
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.replaced = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def create(self, user_id, snapshot, question_ids):
+        session_id = secrets.token_urlsafe(16)
+        answer_key = [snapshot.correct_answer(question_id) for question_id in question_ids]
+        session = QuizSession(session_id, user_id, question_ids, answer_key, time.time() + self.ttl)
+        if self.cache is not None:
+            self.cache.set(user_id, session)
+            self.created += 1
+            return session_id
+        with self._lock:
+            self._purge_expired()
+            if self._sessions.pop(user_id, None) is not None:
+                self.replaced += 1
+            self._sessions[user_id] = session
+            # Oltre il limite vengono scartate le partite più vecchie
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evicted += 1
+            self.created += 1
+        return session_id
+
+    def pop(self, session_id, user_id):
+        # Restituisce e rimuove la partita dell'utente se session_id è quello della partita attiva:
+        # ogni sessione può essere consegnata una sola volta
+        if not isinstance(session_id, str) or not session_id:
+            return None
+        if self.cache is not None:
+            session, _ = self.cache.get(user_id)
+            if session is None or not _matches(session, session_id):
+                return None
+            session = self.cache.pop(user_id)
+            if session is None:
+                return None
+            if session.session_id != session_id:
+                # Nel frattempo l'utente ha aperto una nuova partita: resta quella
+                self.cache.set(user_id, session)
+                return None
+        else:
+            with self._lock:
+                session = self._sessions.get(user_id)
+                if session is None or not _matches(session, session_id):
+                    return None
+                del self._sessions[user_id]
+        if session.expires_at < time.time():
+            self.expired += 1
+            return None
+        return session
+
+    def _purge_expired(self):
+        # Le sessioni sono in ordine di creazione, quindi le scadute sono in testa
+        now = time.time()
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if session.expires_at >= now:
+                break
+            self._sessions.popitem(last=False)
+            self.expired += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'active': len(self),
+                'created': self.created,
+                'replaced': self.replaced,
+                'expired': self.expired,
+                'evicted': self.evicted
+            }
+
+    def __len__(self):
+        if self.cache is not None:
+            return len(self.cache)
+        return len(self._sessions)
+
+
+# Corregge le risposte in un solo passaggio: restituisce (corrette, risposte esatte)
+def grade_answers(session, answers):
+    correct_count = 0
+    correct_answers = []
+    for position, correct_answer in enumerate(session.answer_key):
+        correct_answers.append(correct_answer)
+        # Sono valide solo risposte intere (non booleani o stringhe)
+        if position < len(answers) and type(answers[position]) is int and answers[position] == correct_answer:
+            correct_count += 1
+    return correct_count, correct_answers
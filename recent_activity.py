@@ -0,0 +1,91 @@
+import threading
+from collections import OrderedDict, deque
+
+
+# Attività recente di un utente, come mostrata nella pagina del profilo
+class ActivityRecord:
+    __slots__ = ('activity_type', 'description', 'city', 'created_at')
+
+    def __init__(self, activity_type, description, city, created_at):
+        self.activity_type = activity_type
+        self.description = description
+        self.city = city
+        self.created_at = created_at
+
+    def key(self):
+        return self.created_at, self.activity_type, self.description
+
+
+# Buffer circolare per utente delle ultime `per_user` attività (dalla più recente),
+# con eliminazione LRU degli utenti oltre `max_users`
+class RecentActivityCache:
+    def __init__(self, per_user=10, max_users=5000):
+        self.per_user = per_user
+        self.max_users = max_users
+        # user_id -> [deque di ActivityRecord, completo]
+        # "completo" è False se il buffer contiene solo le attività registrate dopo l'avvio
+        # e deve ancora essere unito a quelle nel database
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _store(self, user_id, records, complete):
+        self._users[user_id] = [deque(records, maxlen=self.per_user), complete]
+        self._users.move_to_end(user_id)
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+
+    def get(self, user_id):
+        # Restituisce la lista delle attività recenti oppure None se vanno lette dal database
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None or not entry[1]:
+                self.misses += 1
+                return None
+            self._users.move_to_end(user_id)
+            self.hits += 1
+            return list(entry[0])
+
+    def record(self, user_id, activity_type, description, city, created_at):
+        record = ActivityRecord(activity_type, description, city, created_at)
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None:
+                # Il resto della storia è nel database: il buffer resta incompleto fino al caricamento
+                self._store(user_id, [record], False)
+            else:
+                entry[0].appendleft(record)
+                self._users.move_to_end(user_id)
+
+    def fill(self, user_id, rows):
+        # rows: tuple (activity_type, description, city, created_at) lette dal database.
+        # Le attività registrate in memoria ma non ancora scritte dal thread in background
+        # vengono unite senza duplicati.
+        records = {}
+        for row in rows:
+            record = ActivityRecord(*row)
+            records[record.key()] = record
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None:
+                for record in entry[0]:
+                    records.setdefault(record.key(), record)
+            ordered = sorted(records.values(), key=lambda record: record.created_at, reverse=True)
+            self._store(user_id, ordered[:self.per_user], True)
+        return ordered[:self.per_user]
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'users': len(self._users), 'hits': self.hits, 'misses': self.misses}
+
+    def __len__(self):
+        return len(self._users)
@@ -0,0 +1,247 @@
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+# Pragma del file di stato condiviso: WAL permette letture concorrenti dai vari processi
+SHARED_STATE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA busy_timeout=5000'
+)
+
+SHARED_STATE_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache ('
+    'namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, stored_at REAL NOT NULL, '
+    'PRIMARY KEY (namespace, key)) WITHOUT ROWID',
+    'CREATE INDEX IF NOT EXISTS ix_cache_stored_at ON cache (namespace, stored_at)',
+    'CREATE TABLE IF NOT EXISTS events ('
+    'id INTEGER PRIMARY KEY AUTOINCREMENT, origin INTEGER NOT NULL, channel TEXT NOT NULL, '
+    'payload TEXT NOT NULL, created_at REAL NOT NULL)'
+)
+
+
+# File SQLite condiviso da tutti i processi worker dello stesso nodo.
+# Ogni thread di ogni processo usa la propria connessione, aperta alla prima richiesta.
+class SharedStore:
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        # Connessioni ereditate con il fork: non vanno chiuse dal processo figlio
+        self._inherited = []
+
+        connection = sqlite3.connect(path, timeout=30)
+        try:
+            for statement in SHARED_STATE_PRAGMAS + SHARED_STATE_SCHEMA:
+                connection.execute(statement)
+            connection.commit()
+        finally:
+            connection.close()
+
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            if connection is not None:
+                self._inherited.append(connection)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            for pragma in SHARED_STATE_PRAGMAS:
+                connection.execute(pragma)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+
+# Cache condivisa tra i processi con la stessa interfaccia di weather_client.TTLCache:
+# get() restituisce (valore, fresco). I valori sono serializzati con pickle.
+class SharedCache:
+    def __init__(self, store, namespace, maxsize, ttl, stale_ttl=0, prune_every=256):
+        self.store = store
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.prune_every = prune_every
+        self._writes = 0
+        # Contatori del processo corrente
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        row = self.store.connection().execute(
+            'SELECT value, stored_at FROM cache WHERE namespace = ? AND key = ?',
+            (self.namespace, repr(key))
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None, False
+
+        age = time.time() - row[1]
+        if age <= self.ttl:
+            self.hits += 1
+            return pickle.loads(row[0]), True
+        if age <= self.ttl + self.stale_ttl:
+            self.stale_hits += 1
+            return pickle.loads(row[0]), False
+        self.misses += 1
+        return None, False
+
+    def set(self, key, value):
+        self.store.connection().execute(
+            'INSERT OR REPLACE INTO cache (namespace, key, value, stored_at) VALUES (?, ?, ?, ?)',
+            (self.namespace, repr(key), pickle.dumps(value, pickle.HIGHEST_PROTOCOL), time.time())
+        )
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            self.prune()
+
+    def pop(self, key):
+        # Lettura e cancellazione nella stessa transazione: un solo processo ottiene il valore
+        connection = self.store.connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(
+                'SELECT value FROM cache WHERE namespace = ? AND key = ?', (self.namespace, repr(key))
+            ).fetchone()
+            if row is not None:
+                connection.execute('DELETE FROM cache WHERE namespace = ? AND key = ?',
+                                   (self.namespace, repr(key)))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return pickle.loads(row[0]) if row is not None else None
+
+    def prune(self):
+        # Elimina le voci scadute e, oltre maxsize, le più vecchie
+        connection = self.store.connection()
+        connection.execute('DELETE FROM cache WHERE namespace = ? AND stored_at < ?',
+                           (self.namespace, time.time() - self.ttl - self.stale_ttl))
+        excess = len(self) - self.maxsize
+        if excess > 0:
+            connection.execute(
+                'DELETE FROM cache WHERE namespace = ? AND key IN '
+                '(SELECT key FROM cache WHERE namespace = ? ORDER BY stored_at LIMIT ?)',
+                (self.namespace, self.namespace, excess)
+            )
+
+    def clear(self):
+        self.store.connection().execute('DELETE FROM cache WHERE namespace = ?', (self.namespace,))
+
+    def stats(self):
+        return {
+            'size': len(self),
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses
+        }
+
+    def __len__(self):
+        return self.store.connection().execute(
+            'SELECT COUNT(*) FROM cache WHERE namespace = ?', (self.namespace,)
+        ).fetchone()[0]
+
+
+# Canale di invalidazione tra processi: publish() scrive un evento nella tabella events,
+# ogni worker legge gli eventi nuovi all'inizio di ogni richiesta e chiama i gestori registrati.
+# Senza store (un solo processo) publish() e poll() non fanno nulla.
+class InvalidationChannel:
+    def __init__(self, app=None, store=None, retention=3600, prune_every=500):
+        self.store = store
+        self.retention = retention
+        self.prune_every = prune_every
+        self._handlers = {}
+        self._resync_handlers = []
+        self._last_id = 0
+        self._lock = threading.Lock()
+        self._published = 0
+        self.received = 0
+        self.resyncs = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self.poll)
+
+    @property
+    def enabled(self):
+        return self.store is not None
+
+    def subscribe(self, channel):
+        # Decoratore: handler(**payload) viene chiamato per gli eventi pubblicati dagli altri processi
+        def decorator(handler):
+            self._handlers.setdefault(channel, []).append(handler)
+            return handler
+        return decorator
+
+    def on_resync(self, handler):
+        # Decoratore: chiamato quando degli eventi sono andati persi (worker inattivo oltre retention)
+        self._resync_handlers.append(handler)
+        return handler
+
+    def start(self):
+        # Ignora gli eventi precedenti: da chiamare nel worker prima di caricare lo stato dal database
+        if not self.enabled:
+            return
+        row = self.store.connection().execute('SELECT MAX(id) FROM events').fetchone()
+        with self._lock:
+            self._last_id = row[0] or 0
+
+    def publish(self, channel, **payload):
+        self.publish_many(channel, [payload])
+
+    def publish_many(self, channel, payloads):
+        # Più eventi con un solo executemany e un solo commit (es. un blocco di attività salvate)
+        if not self.enabled or not payloads:
+            return
+        connection = self.store.connection()
+        origin = os.getpid()
+        now = time.time()
+        rows = [(origin, channel, json.dumps(payload, separators=(',', ':')), now) for payload in payloads]
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.executemany(
+                'INSERT INTO events (origin, channel, payload, created_at) VALUES (?, ?, ?, ?)', rows
+            )
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        before = self._published
+        self._published += len(rows)
+        if before // self.prune_every != self._published // self.prune_every:
+            connection.execute('DELETE FROM events WHERE created_at < ?', (now - self.retention,))
+
+    def poll(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            rows = self.store.connection().execute(
+                'SELECT id, origin, channel, payload FROM events WHERE id > ? ORDER BY id', (self._last_id,)
+            ).fetchall()
+            if not rows:
+                return
+            # Gli id sono consecutivi: un salto significa eventi già eliminati e mai letti
+            gap = self._last_id and rows[0][0] > self._last_id + 1
+            self._last_id = rows[-1][0]
+
+            if gap:
+                self.resyncs += 1
+                for handler in self._resync_handlers:
+                    handler()
+                return
+
+            pid = os.getpid()
+            for _, origin, channel, payload in rows:
+                if origin == pid:
+                    continue
+                self.received += 1
+                for handler in self._handlers.get(channel, ()):
+                    handler(**json.loads(payload))
+
+    def stats(self):
+        return {'published': self._published, 'received': self.received, 'resyncs': self.resyncs}
@@ -1,42 +1,150 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+from flask import Flask, Response, abort, render_template, request, jsonify, redirect, url_for, flash
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user, UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
-import requests
+import click
 import os
-from datetime import datetime, timedelta
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+from leaderboard import Leaderboard
+from weather_client import WeatherClient, WeatherAPIError, local_cache
+from activity_log import ActivityLogWriter
+import db_setup
+import maintenance
+from question_bank import QuestionBank
+from quiz_sessions import QuizSessionStore, grade_answers
+from nickname_index import NicknameIndex
+from forecast import format_forecast
+from identity import IdentityCache
+from recent_activity import RecentActivityCache
+from page_cache import PageCache
+from markupsafe import Markup
+from passwords import PasswordPolicy
+from metrics import Metrics
+from shared_state import SharedStore, SharedCache, InvalidationChannel
+from gazetteer import Gazetteer, read_csv, read_geonames
+from exports import FORMATS as EXPORT_FORMATS, TableExport, parse_since
+from sqlalchemy.exc import IntegrityError
 
 app = Flask(__name__)
 
 # Configurazione dell'applicazione Flask
 app.config['SECRET_KEY'] = 'your-secret-key-here-change-in-production'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///kodland_users.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///kodland_users.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Scrittura delle attività: 'async' (a blocchi in background) oppure 'sync' (un commit per attività)
+app.config['ACTIVITY_LOG_DURABILITY'] = os.getenv('ACTIVITY_LOG_DURABILITY', 'async')
+app.config['ACTIVITY_LOG_BATCH_SIZE'] = int(os.getenv('ACTIVITY_LOG_BATCH_SIZE', '500'))
+app.config['ACTIVITY_LOG_FLUSH_INTERVAL'] = float(os.getenv('ACTIVITY_LOG_FLUSH_INTERVAL', '0.5'))
+app.config['ACTIVITY_LOG_MAX_QUEUE'] = int(os.getenv('ACTIVITY_LOG_MAX_QUEUE', '10000'))
+# Hashing delle password: metodo werkzeug (es. 'scrypt:32768:8:1') oppure 'argon2:<t>:<m>:<p>'
+app.config['PASSWORD_HASH_METHOD'] = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+app.config['PASSWORD_HASH_WORKERS'] = int(os.getenv('PASSWORD_HASH_WORKERS', '2'))
+# Secondi di validità della copia in cache dell'utente autenticato
+app.config['IDENTITY_CACHE_TTL'] = int(os.getenv('IDENTITY_CACHE_TTL', '60'))
+# Numero massimo di utenti con le attività recenti tenute in memoria
+app.config['RECENT_ACTIVITY_MAX_USERS'] = int(os.getenv('RECENT_ACTIVITY_MAX_USERS', '5000'))
+# Pagine HTML renderizzate tenute in cache (una per pagina e per utente) e secondi dopo i quali
+# la classifica in cache viene comunque rigenerata (per la colonna "Ultima Attività")
+app.config['PAGE_CACHE_MAX_ENTRIES'] = int(os.getenv('PAGE_CACHE_MAX_ENTRIES', '2000'))
+app.config['SCOREBOARD_CACHE_TTL'] = int(os.getenv('SCOREBOARD_CACHE_TTL', '60'))
+# File SQLite per lo stato condiviso tra i processi worker (impostato da gunicorn.conf.py);
+# se manca, cache e sessioni dei quiz restano nella memoria del processo
+app.config['SHARED_STATE_PATH'] = os.getenv('SHARED_STATE_PATH')
+# Gazetteer locale delle città (file binario letto con mmap), generato all'avvio dal CSV incluso
+# se non esiste; le città trovate solo dall'API remota vengono aggiunte al suo journal
+app.config['GAZETTEER_PATH'] = os.getenv('GAZETTEER_PATH', os.path.join(app.instance_path, 'gazetteer.bin'))
+app.config['GAZETTEER_SOURCE'] = os.getenv(
+    'GAZETTEER_SOURCE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'gazetteer_it.csv')
+)
+# Massimo di città imparate tenute in memoria e nel journal prima di gazetteer-compact
+app.config['GAZETTEER_MAX_LEARNED'] = int(os.getenv('GAZETTEER_MAX_LEARNED', '5000'))
+# Email (separate da virgole) degli utenti che possono scaricare le esportazioni da /admin/export
+app.config['ADMIN_EMAILS'] = {email.strip().lower() for email in os.getenv('ADMIN_EMAILS', '').split(',') if email.strip()}
+# Soglia (ms) oltre la quale una richiesta viene registrata nel log come lenta e
+# frazione di richieste profilate con cProfile (il profilo viene stampato solo se lenta)
+app.config['SLOW_REQUEST_MS'] = float(os.getenv('SLOW_REQUEST_MS', '0')) or None
+app.config['PROFILE_SAMPLE_RATE'] = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+
+# Dimensioni delle pagine della classifica
+SCOREBOARD_PAGE_SIZE = 50
+SCOREBOARD_MAX_PAGE_SIZE = 200
+LEADERBOARD_MAX_TOP = 100
+# Attività recenti mostrate nel profilo
+RECENT_ACTIVITY_SIZE = 10
+# Fuso orario usato per mostrare le date (ora legale compresa)
+ROME_TZ = ZoneInfo('Europe/Rome')
 
 # Inizializza le estensioni Flask
 db = SQLAlchemy(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
+# Stato condiviso tra i processi: cache SQLite e canale di invalidazione letto a ogni richiesta
+shared_store = SharedStore(app.config['SHARED_STATE_PATH']) if app.config['SHARED_STATE_PATH'] else None
+invalidation = InvalidationChannel(app, shared_store)
+
+def shared_cache(name, maxsize, ttl, stale_ttl=0):
+    return SharedCache(shared_store, name, maxsize, ttl, stale_ttl)
+
+# Politica di hashing delle password (con pool di thread limitato per le verifiche)
+password_policy = PasswordPolicy(app.config['PASSWORD_HASH_METHOD'], workers=app.config['PASSWORD_HASH_WORKERS'])
+
+# Cache delle identità: evita una query al database per ogni richiesta autenticata
+identity_cache = IdentityCache(ttl=app.config['IDENTITY_CACHE_TTL'])
+
+# Ultime attività di ogni utente in memoria: il profilo non interroga il database a ogni visita
+recent_activity = RecentActivityCache(per_user=RECENT_ACTIVITY_SIZE, max_users=app.config['RECENT_ACTIVITY_MAX_USERS'])
+
+# Cache delle pagine renderizzate (già compresse con gzip/brotli) con ETag e Last-Modified
+page_cache = PageCache(max_entries=app.config['PAGE_CACHE_MAX_ENTRIES'])
+
+# Client OpenWeatherMap condiviso (sessione HTTP riutilizzata, cache delle risposte e
+# richieste identiche in corso unificate durante i picchi)
+weather_client = WeatherClient(
+    api_key=os.getenv('OPENWEATHER_API_KEY', '944bb7e7f1b371939b8a50fc65823036'),
+    base_url=os.getenv('OPENWEATHER_BASE_URL', 'http://api.openweathermap.org'),
+    cache_factory=shared_cache if shared_store else local_cache
+)
+
+# Gazetteer locale: suggerimenti e coordinate delle città senza chiamare l'API di geocoding
+gazetteer = Gazetteer(app.config['GAZETTEER_PATH'], max_learned=app.config['GAZETTEER_MAX_LEARNED'])
+if not os.path.exists(gazetteer.path):
+    gazetteer.rebuild(read_csv(app.config['GAZETTEER_SOURCE']))
+
+# Nickname registrati in memoria per verifiche di disponibilità senza query al database
+nickname_index = NicknameIndex()
+
+# Classifica in memoria per ranking e top-N senza ordinare tutta la tabella
+leaderboard = Leaderboard()
+
 # Modello per gli Utenti del sistema
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     nickname = db.Column(db.String(100), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128), nullable=False)
+    password_hash = db.Column(db.String(255), nullable=False)
     total_score = db.Column(db.Integer, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Data dell'ultima attività, mantenuta da add_activity() per evitare una query per giocatore
+    last_activity_at = db.Column(db.DateTime)
 
     def set_password(self, password):
-        # Imposta la password usando il metodo pbkdf2:sha256 per una migliore sicurezza
-        self.password_hash = generate_password_hash(password, method='pbkdf2:sha256')
+        # Imposta la password con il metodo di hashing configurato (PASSWORD_HASH_METHOD)
+        self.password_hash = password_policy.hash(password)
 
     def check_password(self, password):
         # Verifica se la password inserita corrisponde a quella hashata
-        return check_password_hash(self.password_hash, password)
+        return password_policy.verify(self.password_hash, password)
+
+    def password_needs_rehash(self):
+        # True se l'hash salvato usa un metodo o parametri diversi da quelli configurati
+        return password_policy.needs_rehash(self.password_hash)
 
 # Modello per tracciare le Attività degli Utenti
 class UserActivity(db.Model):
+    # AUTOINCREMENT: gli id non vengono mai riusati dopo le cancellazioni (watermark delle esportazioni)
+    __table_args__ = {'sqlite_autoincrement': True}
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     activity_type = db.Column(db.String(50), nullable=False)  # Tipi: 'weather', 'quiz', 'login'
@@ -47,25 +155,252 @@ class UserActivity(db.Model):
     # Relazione con il modello User
     user = db.relationship('User', backref=db.backref('activities', lazy=True))
 
+# Riepilogo giornaliero delle attività archiviate (per utente, giorno e tipo)
+class UserActivityDaily(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    activity_type = db.Column(db.String(50), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
 @login_manager.user_loader
 def load_user(user_id):
-    # Carica l'utente dal database tramite ID
-    return User.query.get(int(user_id))
+    # Usa la copia in cache dell'utente; in caso di assenza lo carica dal database tramite ID
+    user_id = int(user_id)
+    cached = identity_cache.get(user_id)
+    if cached is not None:
+        return cached
+    user = db.session.get(User, user_id)
+    return identity_cache.put(user) if user is not None else None
 
 # Inizializzazione del database
 with app.app_context():
+    # Pragma SQLite (WAL, synchronous=NORMAL, ...) su ogni connessione
+    db_setup.configure_engine(db.engine)
     db.create_all()
+    # Applica le migrazioni (colonne e indici) ai database esistenti
+    db_setup.upgrade_schema(db.engine)
+    # Carica in memoria i nickname registrati
+    nickname_index.load(nickname for (nickname,) in db.session.query(User.nickname))
+    # Carica la classifica in memoria all'avvio
+    leaderboard.load(db.session.query(User.id, User.total_score).all())
+
+@app.cli.command('db-upgrade')
+def db_upgrade_command():
+    # Applica le migrazioni mancanti e mostra la versione dello schema
+    applied = db_setup.upgrade_schema(db.engine)
+    for version, description in applied:
+        print(f'Applicata migrazione {version}: {description}')
+    with db.engine.connect() as connection:
+        print(f'Versione dello schema: {db_setup.schema_version(connection)}')
+
+@app.cli.command('activity-maintenance')
+@click.option('--older-than', 'older_than_days', default=90, show_default=True,
+              help='Archivia le attività più vecchie di questo numero di giorni')
+@click.option('--archive-dir', default='activity_archive', show_default=True,
+              help='Cartella dei file di archivio gzip JSONL')
+@click.option('--chunk-size', default=1000, show_default=True, help='Righe per transazione')
+@click.option('--pause', default=0.05, show_default=True,
+              help='Pausa in secondi tra i blocchi per liberare il lock di scrittura')
+def activity_maintenance_command(older_than_days, archive_dir, chunk_size, pause):
+    # Riepiloga per giorno, archivia e cancella le attività vecchie
+    archived, archive_path = maintenance.archive_activities(
+        db, UserActivity, UserActivityDaily, older_than_days, archive_dir,
+        chunk_size=chunk_size, pause=pause
+    )
+    if archived:
+        print(f'Archiviate {archived} attività in {archive_path}')
+    else:
+        print('Nessuna attività da archiviare')
+
+@app.cli.command('gazetteer-build')
+@click.option('--source', default=None, help='CSV (name,state,country,lat,lon,population) o file TSV di GeoNames; '
+              'predefinito: GAZETTEER_SOURCE')
+@click.option('--min-population', default=0, show_default=True, help='Solo per GeoNames: popolazione minima')
+def gazetteer_build_command(source, min_population):
+    # Rigenera il gazetteer dal file sorgente, mantenendo le città imparate dall'API remota
+    source = source or app.config['GAZETTEER_SOURCE']
+    if source.endswith('.csv'):
+        records = read_csv(source)
+    else:
+        records = read_geonames(source, min_population)
+    count = gazetteer.rebuild(records)
+    print(f'Gazetteer {gazetteer.path}: {count} città')
+
+@app.cli.command('gazetteer-compact')
+def gazetteer_compact_command():
+    # Unisce il journal delle città imparate alla tabella binaria
+    count = gazetteer.rebuild()
+    print(f'Gazetteer {gazetteer.path}: {count} città')
+
+# Tabelle esportabili con export e /admin/export: nome -> (modello, colonne)
+EXPORT_TABLES = {
+    'users': (User, ('id', 'nickname', 'total_score', 'created_at', 'last_activity_at')),
+    'activities': (UserActivity, ('id', 'user_id', 'activity_type', 'description', 'city', 'created_at'))
+}
+
+def table_export(name, fmt, since=None, after_id=None, compress=False):
+    model, columns = EXPORT_TABLES[name]
+    return TableExport(db.engine, model.__table__, columns, fmt, since=since, after_id=after_id,
+                       compress=compress, name=name)
+
+@app.cli.command('export')
+@click.argument('table', type=click.Choice(sorted(EXPORT_TABLES)))
+@click.option('--format', 'fmt', type=click.Choice(sorted(EXPORT_FORMATS)), default='csv', show_default=True)
+@click.option('--since', default=None, help='Solo le righe con created_at successivo (data ISO 8601, UTC)')
+@click.option('--after-id', type=click.IntRange(min=0), default=None,
+              help='Solo le righe con id maggiore: il watermark stampato dall\'esportazione precedente')
+@click.option('--output', '-o', default='-', show_default=True,
+              help='File di destinazione (- per stdout); con estensione .gz viene compresso con gzip')
+@click.option('--gzip', 'compress', is_flag=True, help='Comprime con gzip anche su stdout')
+def export_command(table, fmt, since, after_id, output, compress):
+    # Esporta punteggi o attività in streaming; il watermark finale (id) va passato a --after-id
+    # nell'esportazione successiva (es. job notturno incrementale)
+    try:
+        since = parse_since(since)
+    except ValueError:
+        raise click.BadParameter('data ISO 8601 non valida', param_hint='--since')
+    export = table_export(table, fmt, since, after_id, compress or output.endswith('.gz'))
+    with click.open_file(output, 'wb') as destination:
+        for data in export:
+            destination.write(data)
+    click.echo(f'Esportate {export.rows} righe da {table}; watermark: {export.watermark}', err=True)
+
+# Scrittore delle attività: accoda le righe e le salva con inserimenti in blocco
+activity_writer = ActivityLogWriter(
+    app, db, UserActivity, User,
+    durability=app.config['ACTIVITY_LOG_DURABILITY'],
+    max_queue=app.config['ACTIVITY_LOG_MAX_QUEUE'],
+    batch_size=app.config['ACTIVITY_LOG_BATCH_SIZE'],
+    flush_interval=app.config['ACTIVITY_LOG_FLUSH_INTERVAL']
+)
+# Salva le attività ancora in coda alla chiusura del processo
+activity_writer.register_shutdown()
 
 # Funzione di utilità per registrare le attività degli utenti
-def add_activity(user, activity_type, description, city=None):
-    activity = UserActivity(
-        user_id=user.id,
-        activity_type=activity_type,
-        description=description,
-        city=city
-    )
-    db.session.add(activity)
-    db.session.commit()
+def add_activity(user, activity_type, description, city=None, commit=True):
+    created_at = datetime.utcnow()
+    # Gli altri processi worker ricevono l'attività dopo il salvataggio: a blocchi da
+    # publish_activities(), oppure con l'evento 'score' della transazione del chiamante
+    recent_activity.record(user.id, activity_type, description, city, created_at)
+    if not commit:
+        # L'attività entra nella transazione corrente, che verrà confermata dal chiamante
+        activity = UserActivity(
+            user_id=user.id,
+            activity_type=activity_type,
+            description=description,
+            city=city,
+            created_at=created_at
+        )
+        db.session.add(activity)
+        # Aggiorna la colonna denormalizzata usata dalla classifica
+        user.last_activity_at = created_at
+        return
+
+    activity_writer.log(user.id, activity_type, description, city, created_at)
+
+def publish_activities(rows):
+    # Chiamata dal thread di scrittura dopo ogni blocco salvato: un solo INSERT multiplo
+    # nel file condiviso invece di una scrittura per attività durante la richiesta
+    invalidation.publish_many('activity', [{
+        'user_id': row['user_id'],
+        'activity_type': row['activity_type'],
+        'description': row['description'],
+        'city': row['city'],
+        'created_at': row['created_at'].isoformat()
+    } for row in rows])
+
+activity_writer.on_flush = publish_activities
+
+# Eventi pubblicati dagli altri processi worker: aggiornano lo stato in memoria di questo processo
+@invalidation.subscribe('activity')
+def on_activity(user_id, activity_type, description, city, created_at):
+    recent_activity.record(user_id, activity_type, description, city, datetime.fromisoformat(created_at))
+
+@invalidation.subscribe('score')
+def on_score_changed(user_id, total_score):
+    identity_cache.invalidate(user_id)
+    # L'attività del quiz è stata salvata insieme al punteggio: il profilo la rilegge dal database
+    recent_activity.invalidate(user_id)
+    leaderboard.update(user_id, total_score)
+    page_cache.invalidate('scoreboard')
+
+@invalidation.subscribe('user_registered')
+def on_user_registered(user_id, nickname):
+    nickname_index.add(nickname)
+    leaderboard.update(user_id, 0)
+    page_cache.invalidate('scoreboard')
+
+@invalidation.on_resync
+def reload_process_state():
+    # Ricarica dal database indici e classifica e svuota le cache locali del processo
+    with app.app_context():
+        nickname_index.load(nickname for (nickname,) in db.session.query(User.nickname))
+        leaderboard.load(db.session.query(User.id, User.total_score).all())
+    identity_cache.clear()
+    recent_activity.clear()
+    page_cache.clear()
+
+# Calcola le statistiche della classifica direttamente in SQL
+def scoreboard_stats():
+    players_count, max_score, average_score = db.session.query(
+        db.func.count(User.id),
+        db.func.max(User.total_score),
+        db.func.avg(User.total_score)
+    ).one()
+    return {
+        'players_count': players_count,
+        'max_score': max_score or 0,
+        'average_score': round(average_score) if average_score is not None else 0
+    }
+
+# Restituisce una pagina della classifica con paginazione keyset su (total_score DESC, id ASC)
+def scoreboard_page(after_score=None, after_id=None, limit=SCOREBOARD_PAGE_SIZE):
+    query = User.query
+    if after_score is not None and after_id is not None:
+        # La condizione su total_score <= after_score permette a SQLite di partire
+        # direttamente dal punto giusto dell'indice ix_user_total_score
+        query = query.filter(
+            User.total_score <= after_score,
+            db.or_(User.total_score < after_score, User.id > after_id)
+        )
+    return query.order_by(User.total_score.desc(), User.id.asc()).limit(limit).all()
+
+# Metriche: latenza per endpoint, query SQL per richiesta e chiamate esterne, esposte su /metrics
+metrics = Metrics(app, db)
+weather_client.observer = metrics.observe_upstream
+
+def collect_app_stats():
+    # Valori istantanei di cache e code, letti a ogni richiesta di /metrics
+    weather_stats = weather_client.stats()
+    values = []
+    for cache_name in ('geocode', 'forecast'):
+        for stat in ('hits', 'stale_hits', 'misses', 'size'):
+            values.append(('kodland_weather_cache_' + stat, (('cache', cache_name),), weather_stats[cache_name][stat]))
+    values.append(('kodland_weather_coalesced_requests', (), weather_stats['coalesced']))
+    gazetteer_stats = gazetteer.stats()
+    for stat in ('table', 'overlay', 'learned', 'skipped', 'hits', 'misses'):
+        values.append(('kodland_gazetteer_' + stat, (), gazetteer_stats[stat]))
+    writer_stats = activity_writer.stats()
+    for stat in ('queue_depth', 'written', 'overflow', 'flush_count', 'flush_errors', 'dropped',
+                 'last_flush_ms', 'max_flush_ms', 'avg_flush_ms'):
+        values.append(('kodland_activity_log_' + stat, (), writer_stats[stat]))
+    identity_stats = identity_cache.stats()
+    values.append(('kodland_identity_cache_hits', (), identity_stats['hits']))
+    values.append(('kodland_identity_cache_misses', (), identity_stats['misses']))
+    page_stats = page_cache.stats()
+    for stat in ('size', 'hits', 'misses', 'bypassed'):
+        values.append(('kodland_page_cache_' + stat, (), page_stats[stat]))
+    recent_stats = recent_activity.stats()
+    for stat in ('users', 'hits', 'misses'):
+        values.append(('kodland_recent_activity_' + stat, (), recent_stats[stat]))
+    values.append(('kodland_quiz_sessions_active', (), len(quiz_sessions)))
+    invalidation_stats = invalidation.stats()
+    for stat in ('published', 'received', 'resyncs'):
+        values.append(('kodland_invalidation_events_' + stat, (), invalidation_stats[stat]))
+    values.append(('kodland_leaderboard_players', (), len(leaderboard)))
+    return values
+
+metrics.add_collector(collect_app_stats)
 
 # Database delle Domande Quiz - Sviluppo AI e Python
 quiz_questions = [
@@ -127,19 +462,40 @@ quiz_questions = [
     {"question": "Nel reinforcement learning, cosa rappresenta la 'reward function'?", "options": ["La velocità di apprendimento", "Il feedback per le azioni", "La complessità dell'ambiente", "Il tipo di algoritmo"], "correct": 1}
 ]
 
+# Numero di domande per partita e punti per ogni risposta corretta
+QUIZ_SIZE = 30
+QUIZ_POINTS_PER_CORRECT = 2
+
+# Banca domande serializzata una sola volta; se QUIZ_QUESTIONS_FILE punta a un file JSON
+# le domande vengono lette da lì e ricaricate quando il file cambia
+question_bank = QuestionBank(quiz_questions, path=os.getenv('QUIZ_QUESTIONS_FILE'))
+
+# Partite in corso: le domande estratte restano sul server e le risposte vengono corrette qui.
+# Con più processi stanno nella cache condivisa: la consegna può arrivare a un altro worker.
+QUIZ_SESSION_TTL = int(os.getenv('QUIZ_SESSION_TTL', '7200'))
+QUIZ_MAX_SESSIONS = int(os.getenv('QUIZ_MAX_SESSIONS', '20000'))
+quiz_sessions = QuizSessionStore(
+    ttl=QUIZ_SESSION_TTL,
+    max_sessions=QUIZ_MAX_SESSIONS,
+    cache=shared_cache('quiz_sessions', QUIZ_MAX_SESSIONS, QUIZ_SESSION_TTL) if shared_store else None
+)
+
 # Definizione delle Route dell'applicazione Flask
 @app.route('/')
+@page_cache.cached()
 def starter():
     # Pagina di benvenuto iniziale
     return render_template('starter.html')
 
 @app.route('/homepage')
 @login_required
+@page_cache.cached()
 def homepage():
     # Dashboard principale per utenti autenticati
     return render_template('homepage.html')
 
 @app.route('/login', methods=['GET', 'POST'])
+@page_cache.cached(flashes=True)
 def login():
     if request.method == 'POST':
         email = request.form.get('email')
@@ -153,6 +509,10 @@ def login():
         user = User.query.filter_by(email=email).first()
         
         if user and user.check_password(password):
+            # Aggiorna in modo trasparente gli hash creati con una politica precedente
+            if user.password_needs_rehash():
+                user.set_password(password)
+                db.session.commit()
             login_user(user)
             # Registra l'attività di accesso dell'utente
             add_activity(user, 'login', 'Ha effettuato l\'accesso al sistema')
@@ -164,6 +524,7 @@ def login():
     return render_template('login.html')
 
 @app.route('/registration', methods=['GET', 'POST'])
+@page_cache.cached(flashes=True)
 def registration():
     if request.method == 'POST':
         nickname = request.form.get('nickname')
@@ -191,8 +552,8 @@ def registration():
             flash('Un utente con questa email esiste già', 'error')
             return redirect(url_for('registration'))
         
-        # Verifica se il nickname è già in uso
-        if User.query.filter_by(nickname=nickname).first():
+        # Verifica se il nickname è già in uso (senza distinzione tra maiuscole e minuscole)
+        if nickname_index.is_taken(nickname):
             flash('Questo nickname è già in uso. Scegli un nickname diverso.', 'error')
             return redirect(url_for('registration'))
         
@@ -200,7 +561,17 @@ def registration():
         new_user = User(nickname=nickname, email=email)
         new_user.set_password(password)
         db.session.add(new_user)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Registrazione concorrente con lo stesso nickname o email: vince il vincolo UNIQUE
+            db.session.rollback()
+            flash('Nickname o email già in uso. Riprova.', 'error')
+            return redirect(url_for('registration'))
+        nickname_index.add(new_user.nickname)
+        leaderboard.update(new_user.id, new_user.total_score)
+        page_cache.invalidate('scoreboard')
+        invalidation.publish('user_registered', user_id=new_user.id, nickname=new_user.nickname)
         
         flash('Registrazione completata con successo! Ora puoi accedere.', 'success')
         return redirect(url_for('login'))
@@ -211,6 +582,7 @@ def registration():
 @login_required
 def logout():
     # Disconnette l'utente dal sistema
+    identity_cache.invalidate(current_user.id)
     logout_user()
     flash('Logout effettuato con successo!', 'success')
     return redirect(url_for('starter'))
@@ -225,49 +597,82 @@ def quiz():
 @app.route('/api/quiz/questions')
 @login_required
 def get_quiz_questions():
-    # Restituisce 30 domande casuali per un quiz quasi infinito
-    import random
-    selected_questions = random.sample(quiz_questions, min(30, len(quiz_questions)))
-    return jsonify(selected_questions)
+    # Restituisce 30 domande casuali (senza la risposta corretta) e apre una sessione di quiz
+    snapshot, question_ids, questions_json = question_bank.draw(QUIZ_SIZE)
+    session_id = quiz_sessions.create(current_user.id, snapshot, question_ids)
+    body = b'{"session_id":"' + session_id.encode('ascii') + b'","questions":' + questions_json + b'}'
+    return Response(body, mimetype='application/json')
+
+@app.route('/api/quiz/bank')
+@login_required
+def get_quiz_bank():
+    # Restituisce l'intera banca domande, con ETag per le richieste condizionali
+    body, etag = question_bank.full_json()
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
 
 @app.route('/api/quiz/submit', methods=['POST'])
 @login_required
 def submit_quiz():
-    data = request.get_json()
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('session_id'), str):
+        return jsonify({'success': False, 'error': 'Sessione del quiz scaduta o non valida'}), 400
     answers = data.get('answers', [])
-    current_score = data.get('score', 0)
+    if not isinstance(answers, list):
+        return jsonify({'success': False, 'error': 'Formato delle risposte non valido'}), 400
+
+    # Il punteggio viene calcolato sul server a partire dalla sessione del quiz
+    session = quiz_sessions.pop(data['session_id'], current_user.id)
+    if session is None:
+        return jsonify({'success': False, 'error': 'Sessione del quiz scaduta o non valida'}), 400
+
+    correct_count, correct_answers = grade_answers(session, answers)
+    current_score = correct_count * QUIZ_POINTS_PER_CORRECT
     
-    # Aggiorna il punteggio totale dell'utente
-    current_user.total_score += current_score
+    # Aggiorna il punteggio totale e registra il completamento del quiz in un'unica transazione
+    # (current_user è una copia in cache, quindi si modifica l'utente caricato dal database)
+    user = db.session.get(User, current_user.id)
+    user.total_score += current_score
+    add_activity(user, 'quiz_completion', f'Ha completato un quiz con punteggio: {current_score} punti', commit=False)
     db.session.commit()
-    
-    # Registra il completamento del quiz
-    add_activity(current_user, 'quiz_completion', f'Ha completato un quiz con punteggio: {current_score} punti')
+    identity_cache.invalidate(user.id)
+    leaderboard.update(user.id, user.total_score)
+    page_cache.invalidate('scoreboard')
+    invalidation.publish('score', user_id=user.id, total_score=user.total_score)
     
     return jsonify({
         'success': True,
-        'total_score': current_user.total_score,
+        'score': current_score,
+        'correct_count': correct_count,
+        'correct_answers': correct_answers,
+        'total_score': user.total_score,
         'message': f'Quiz completato! Hai totalizzato {current_score} punti.'
     })
 
 @app.route('/profile')
 @login_required
 def profile():
-    # Ottiene le attività recenti dell'utente (ultime 10)
-    activities = UserActivity.query.filter_by(user_id=current_user.id)\
-        .order_by(UserActivity.created_at.desc())\
-        .limit(10)\
-        .all()
-    
-    # Converte gli orari UTC nel fuso orario di Roma (UTC+1)
-    from datetime import timezone, timedelta
-    rome_tz = timezone(timedelta(hours=1))
-    for activity in activities:
-        # Converte l'orario UTC in fuso di Roma
-        activity.rome_time = activity.created_at.replace(tzinfo=timezone.utc).astimezone(rome_tz)
+    # Attività recenti dell'utente (ultime 10) dal buffer in memoria;
+    # il database viene letto solo la prima volta o dopo l'eliminazione dalla cache
+    activities = recent_activity.get(current_user.id)
+    if activities is None:
+        rows = db.session.query(
+            UserActivity.activity_type, UserActivity.description, UserActivity.city, UserActivity.created_at
+        ).filter_by(user_id=current_user.id)\
+            .order_by(UserActivity.created_at.desc())\
+            .limit(RECENT_ACTIVITY_SIZE)\
+            .all()
+        activities = recent_activity.fill(current_user.id, rows)
     
     return render_template('profile.html', activities=activities)
 
+@app.template_filter('rome_time')
+def rome_time_filter(value, fmt='%d/%m/%Y %H:%M'):
+    # Converte un orario UTC (salvato senza fuso) nell'ora di Roma al momento della visualizzazione
+    return value.replace(tzinfo=timezone.utc).astimezone(ROME_TZ).strftime(fmt)
+
 @app.route('/nickname-suggestions')
 def nickname_suggestions():
     query = request.args.get('q', '').strip()
@@ -275,10 +680,6 @@ def nickname_suggestions():
         return jsonify([])
     
     try:
-        # Controlla nicknames esistenti che contengono la query
-        existing_users = User.query.filter(User.nickname.ilike(f'%{query}%')).all()
-        existing_nicknames = [user.nickname for user in existing_users]
-        
         # Genera suggerimenti intelligenti basati sulla query
         suggestions = []
         base_name = query.lower()
@@ -312,11 +713,19 @@ def nickname_suggestions():
                 suggestion = f"{query.title()}{suffix}"
             
             else:
-                # Varianti con underscore + numeri
-                suggestion = f"{query}_{i-8}"
+                # Varianti con underscore + primo numero libero, cercato per prefisso nell'indice
+                taken_numbers = {
+                    int(name[len(query) + 1:])
+                    for name in nickname_index.with_prefix(f"{query}_")
+                    if name[len(query) + 1:].isdigit()
+                }
+                number = 1
+                while number in taken_numbers:
+                    number += 1
+                suggestion = f"{query}_{number}"
             
             # Aggiungi solo se il nickname non è già occupato
-            if suggestion not in existing_nicknames:
+            if not nickname_index.is_taken(suggestion):
                 suggestions.append(suggestion)
                 
             if len(suggestions) >= 5:
@@ -327,6 +736,31 @@ def nickname_suggestions():
     except Exception as e:
         return jsonify([])
 
+# Formatta i risultati del geocoding come suggerimenti per l'autocompletamento
+def format_city_suggestions(geo_data):
+    suggestions = []
+    for city in geo_data:
+        country = city.get('country', '')
+        state = city.get('state', '')
+        city_name = city['name']
+
+        # Formatta il nome per la visualizzazione
+        if state and country:
+            display_name = f"{city_name}, {state}, {country}"
+        elif country:
+            display_name = f"{city_name}, {country}"
+        else:
+            display_name = city_name
+
+        suggestions.append({
+            'name': city_name,
+            'display': display_name,
+            'country': country,
+            'state': state
+        })
+
+    return suggestions
+
 @app.route('/city-suggestions')
 @login_required
 def city_suggestions():
@@ -334,41 +768,20 @@ def city_suggestions():
     if not query or len(query) < 2:
         return jsonify([])
 
-    api_key = os.getenv('OPENWEATHER_API_KEY', '944bb7e7f1b371939b8a50fc65823036')
-
     try:
-        # Ottiene suggerimenti di città dall'API OpenWeatherMap
-        geo_url = f'http://api.openweathermap.org/geo/1.0/direct?q={query}&limit=5&appid={api_key}'
-        geo_response = requests.get(geo_url)
-        geo_data = geo_response.json()
-
-        if geo_response.status_code != 200:
-            return jsonify([])
-
-        suggestions = []
-        for city in geo_data:
-            country = city.get('country', '')
-            state = city.get('state', '')
-            city_name = city['name']
-
-            # Formatta il nome per la visualizzazione
-            if state and country:
-                display_name = f"{city_name}, {state}, {country}"
-            elif country:
-                display_name = f"{city_name}, {country}"
-            else:
-                display_name = city_name
-
-            suggestions.append({
-                'name': city_name,
-                'display': display_name,
-                'country': country,
-                'state': state
-            })
-
-        return jsonify(suggestions)
-
-    except Exception as e:
+        # Suggerimenti dal gazetteer locale; solo se sono troppo pochi si chiede (una volta per
+        # prefisso) all'API OpenWeatherMap, e le città restituite vengono aggiunte al gazetteer
+        geo_data = gazetteer.search(query, limit=5)
+        if gazetteer.needs_remote(query, geo_data):
+            try:
+                remote = weather_client.geocode(query, limit=5)
+            except Exception:
+                # API non raggiungibile: bastano i suggerimenti locali
+                remote = []
+            geo_data = gazetteer.merge(query, geo_data, remote, 5)
+        return jsonify(format_city_suggestions(geo_data))
+
+    except Exception:
         return jsonify([])
 
 @app.route('/weather')
@@ -378,15 +791,10 @@ def weather():
     if not city:
         return jsonify({'error': 'Città non specificata'})
 
-    # Utilizza l'API OpenWeatherMap per le previsioni
-    api_key = os.getenv('OPENWEATHER_API_KEY', '944bb7e7f1b371939b8a50fc65823036')
-    base_url = 'http://api.openweathermap.org/data/2.5/forecast'
-
     try:
-        # Ottiene prima le coordinate geografiche
-        geo_url = f'http://api.openweathermap.org/geo/1.0/direct?q={city}&limit=1&appid={api_key}'
-        geo_response = requests.get(geo_url)
-        geo_data = geo_response.json()
+        # Ottiene prima le coordinate geografiche (dal gazetteer locale se la città è nota);
+        # con alias=True il nome cercato resta associato alla città trovata dall'API
+        geo_data = gazetteer.lookup(city) or gazetteer.learn(city, weather_client.geocode(city, limit=1), alias=True)
 
         if not geo_data:
             return jsonify({'error': 'Città non trovata'})
@@ -395,55 +803,13 @@ def weather():
         lon = geo_data[0]['lon']
 
         # Richiede previsioni a 5 giorni
-        forecast_url = f'{base_url}?lat={lat}&lon={lon}&appid={api_key}&units=metric&lang=it'
-        forecast_response = requests.get(forecast_url)
-        forecast_data = forecast_response.json()
-
-        if forecast_response.status_code != 200:
+        try:
+            forecast_data = weather_client.forecast(lat, lon)
+        except WeatherAPIError:
             return jsonify({'error': 'Errore nel recupero delle previsioni'})
 
-        # Elabora le previsioni per 3 giorni
-        forecast = []
-        today = datetime.now().date()
-
-        # Nomi italiani per giorni e mesi
-        italian_days = ['Lunedì', 'Martedì', 'Mercoledì', 'Giovedì', 'Venerdì', 'Sabato', 'Domenica']
-        italian_months = ['GEN', 'FEB', 'MAR', 'APR', 'MAG', 'GIU', 'LUG', 'AGO', 'SET', 'OTT', 'NOV', 'DIC']
-
-        for i in range(3):
-            target_date = today + timedelta(days=i)
-            day_forecasts = [item for item in forecast_data['list'] if datetime.fromtimestamp(item['dt']).date() == target_date]
-
-            if day_forecasts:
-                # Calcola temperature diurne e notturne
-                temps = [item['main']['temp'] for item in day_forecasts]
-                day_temp = max(temps)
-                night_temp = min(temps)
-
-                # Trova la condizione meteorologica più comune
-                weather_conditions = [item['weather'][0]['description'] for item in day_forecasts]
-                weather = max(set(weather_conditions), key=weather_conditions.count)
-
-                # Crea stringa dettagliata della data
-                target_datetime = datetime.combine(target_date, datetime.min.time())
-                day_name = italian_days[target_datetime.weekday()]
-                month_name = italian_months[target_date.month - 1]
-                date_str = f"{day_name} {target_date.day} {month_name} {target_date.year}"
-                
-                # Aggiunge riferimenti semplici per compatibilità
-                if i == 0:
-                    date_str = f"Oggi - {date_str}"
-                elif i == 1:
-                    date_str = f"Domani - {date_str}"
-                elif i == 2:
-                    date_str = f"Dopodomani - {date_str}"
-
-                forecast.append({
-                    'date': date_str,
-                    'weather': weather.capitalize(),
-                    'day_temp': round(day_temp),
-                    'night_temp': round(night_temp)
-                })
+        # Elabora le previsioni per 3 giorni (fino a 5 con il parametro days)
+        forecast = format_forecast(forecast_data, days=request.args.get('days', 3, type=int))
 
         # Registra l'attività meteo dell'utente
         add_activity(current_user, 'weather', f'Ha consultato le previsioni meteo per {city.title()}', city)
@@ -458,27 +824,138 @@ def weather():
 
 @app.route('/scoreboard')
 @login_required
+@page_cache.cached(tags=('scoreboard',), ttl=app.config['SCOREBOARD_CACHE_TTL'])
 def scoreboard():
-    # Ottiene tutti gli utenti ordinati per punteggio totale (decrescente)
-    players = User.query.order_by(User.total_score.desc()).all()
-    
-    # Aggiunge l'ultima attività per ogni giocatore
-    for player in players:
-        last_activity = UserActivity.query.filter_by(user_id=player.id)\
-            .order_by(UserActivity.created_at.desc())\
-            .first()
-        player.last_activity = last_activity.created_at if last_activity else None
-    
-    # Calcola statistiche generali
-    players_count = len(players)
-    max_score = max([p.total_score for p in players]) if players else 0
-    average_score = round(sum([p.total_score for p in players]) / players_count) if players_count > 0 else 0
-    
+    # Mostra solo la prima pagina: le successive arrivano da /api/scoreboard.
+    # Statistiche e prima pagina sono un frammento condiviso da tutti gli utenti,
+    # rigenerato quando cambia un punteggio o si registra un nuovo utente.
+    ranking_html = page_cache.fragment('scoreboard_ranking', lambda: render_template(
+        'scoreboard_ranking.html',
+        players=scoreboard_page(),
+        page_size=SCOREBOARD_PAGE_SIZE,
+        **scoreboard_stats()
+    ), tags=('scoreboard',), ttl=app.config['SCOREBOARD_CACHE_TTL'])
+
     return render_template('scoreboard.html',
-                         players=players,
-                         players_count=players_count,
-                         max_score=max_score,
-                         average_score=average_score)
+                         ranking_html=Markup(ranking_html),
+                         page_size=SCOREBOARD_PAGE_SIZE)
+
+@app.route('/api/scoreboard')
+@login_required
+def scoreboard_api():
+    after_score = request.args.get('after_score', type=int)
+    after_id = request.args.get('after_id', type=int)
+    limit = request.args.get('limit', SCOREBOARD_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, SCOREBOARD_MAX_PAGE_SIZE))
+
+    players = scoreboard_page(after_score, after_id, limit)
+
+    # Cursore per la pagina successiva (None se la classifica è terminata)
+    next_cursor = None
+    if len(players) == limit:
+        next_cursor = {'after_score': players[-1].total_score, 'after_id': players[-1].id}
+
+    result = {
+        'players': [{
+            'id': player.id,
+            'nickname': player.nickname,
+            'total_score': player.total_score,
+            'created_at': player.created_at.strftime('%d/%m/%Y') if player.created_at else None,
+            'last_activity': player.last_activity_at.strftime('%d/%m/%Y %H:%M') if player.last_activity_at else None
+        } for player in players],
+        'next': next_cursor
+    }
+    # Le statistiche (COUNT/AVG su tutta la tabella) solo con la prima pagina:
+    # le pagine successive restano a costo costante anche con molti utenti
+    if after_score is None or after_id is None:
+        result['stats'] = scoreboard_stats()
+    return jsonify(result)
+
+@app.route('/api/scoreboard/rank/<int:user_id>')
+@login_required
+def scoreboard_rank(user_id):
+    rank = leaderboard.rank(user_id)
+    if rank is None:
+        return jsonify({'error': 'Utente non trovato'}), 404
+
+    return jsonify({
+        'user_id': user_id,
+        'rank': rank,
+        'total_score': leaderboard.score(user_id),
+        'players_count': len(leaderboard)
+    })
+
+@app.route('/api/scoreboard/top')
+@login_required
+def scoreboard_top():
+    n = request.args.get('n', 10, type=int)
+    n = max(1, min(n, LEADERBOARD_MAX_TOP))
+
+    top_players = leaderboard.top(n)
+    # Una sola query per chiave primaria per recuperare i nickname
+    nicknames = dict(db.session.query(User.id, User.nickname)
+                     .filter(User.id.in_([user_id for user_id, _ in top_players])).all())
+
+    return jsonify([{
+        'rank': position,
+        'id': user_id,
+        'nickname': nicknames.get(user_id),
+        'total_score': total_score
+    } for position, (user_id, total_score) in enumerate(top_players, start=1)])
+
+@app.route('/admin/export/<table>')
+@login_required
+def admin_export(table):
+    # Solo per gli utenti in ADMIN_EMAILS; stessi parametri del comando export:
+    # ?format=csv|jsonl&since=<data ISO>&after_id=<watermark>&gzip=1
+    # Il watermark per l'esportazione successiva è nell'header X-Export-Watermark
+    if current_user.email.lower() not in app.config['ADMIN_EMAILS']:
+        abort(403)
+    if table not in EXPORT_TABLES:
+        abort(404)
+
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': 'Formato non supportato'}), 400
+    try:
+        since = parse_since(request.args.get('since'))
+    except ValueError:
+        return jsonify({'error': 'Data since non valida'}), 400
+    after_id = request.args.get('after_id', 0, type=int)
+    if after_id < 0:
+        return jsonify({'error': 'after_id non valido'}), 400
+
+    # Il corpo viene generato durante l'invio: le righe non sono mai tutte in memoria
+    export = table_export(table, fmt, since, after_id, request.args.get('gzip', type=int) == 1)
+    watermark = export.bound()
+    return Response(iter(export), mimetype=export.mimetype, headers={
+        'Content-Disposition': f'attachment; filename={export.filename}',
+        'Cache-Control': 'no-store',
+        'X-Export-Watermark': str(watermark)
+    })
+
+# Inizializzazione di ogni processo worker, da chiamare dopo il fork (post_fork di gunicorn):
+# connessioni e thread creati dal processo padre non sono utilizzabili nel figlio
+_worker_pid = None
+
+def init_worker():
+    global _worker_pid
+    if _worker_pid == os.getpid():
+        return
+    _worker_pid = os.getpid()
+    with app.app_context():
+        db.engine.dispose(close=False)
+    weather_client.after_fork()
+    password_policy.after_fork()
+    activity_writer.after_fork()
+    # Prima si posiziona il canale, poi si ricarica lo stato: gli eventi nel mezzo vengono riletti
+    invalidation.start()
+    reload_process_state()
+
+def create_app():
+    # Punto di ingresso per i server WSGI (vedi wsgi.py e gunicorn.conf.py)
+    init_worker()
+    return app
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, 'benchmarks')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from fake_openweather import FakeOpenWeatherServer
+
+
+@pytest.fixture(scope='session')
+def fake_openweather():
+    # Finto OpenWeatherMap locale, condiviso dai test (i contatori vengono azzerati da ogni test)
+    server = FakeOpenWeatherServer().start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def upstream(fake_openweather):
+    fake_openweather.latency = 0.0
+    for kind in fake_openweather.request_counts:
+        fake_openweather.request_counts[kind] = 0
+    return fake_openweather
@@ -0,0 +1,126 @@
+import threading
+import time
+
+import pytest
+
+import weather_client
+from weather_client import TTLCache, WeatherClient
+
+
+class FakeClock:
+    # Sostituisce il modulo time in weather_client: il tempo avanza solo con advance()
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def perf_counter(self):
+        return time.perf_counter()
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(weather_client, 'time', clock)
+    return clock
+
+
+def make_client(upstream, **options):
+    return WeatherClient(api_key='test', base_url=upstream.base_url, **options)
+
+
+def wait_for_refresh(client, timeout=5):
+    deadline = time.monotonic() + timeout
+    while client._refreshing and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not client._refreshing
+
+
+def test_geocode_is_cached_by_normalized_query(upstream, clock):
+    client = make_client(upstream)
+
+    first = client.geocode('Roma', limit=1)
+    second = client.geocode('  roma ', limit=1)
+
+    assert first == second
+    assert upstream.request_counts['geocode'] == 1
+    stats = client.stats()['geocode']
+    assert (stats['hits'], stats['misses'], stats['size']) == (1, 1, 1)
+
+
+def test_stale_forecast_is_served_and_refreshed_in_background(upstream, clock):
+    client = make_client(upstream, forecast_ttl=600, stale_ttl=300)
+    fresh = client.forecast(41.89, 12.48)
+
+    clock.advance(700)
+    stale = client.forecast(41.89, 12.48)
+    assert stale is fresh
+    assert client.stats()['forecast']['stale_hits'] == 1
+
+    wait_for_refresh(client)
+    assert upstream.request_counts['forecast'] == 2
+    client.forecast(41.89, 12.48)
+    assert client.stats()['forecast']['hits'] == 1
+
+
+def test_entry_older_than_stale_window_is_fetched_again(upstream, clock):
+    client = make_client(upstream, forecast_ttl=600, stale_ttl=300)
+    client.forecast(45.46, 9.19)
+
+    clock.advance(901)
+    client.forecast(45.46, 9.19)
+
+    assert upstream.request_counts['forecast'] == 2
+    stats = client.stats()['forecast']
+    assert (stats['hits'], stats['stale_hits'], stats['misses']) == (0, 0, 2)
+
+
+def test_least_recently_used_entry_is_evicted(upstream, clock):
+    client = make_client(upstream, cache_size=2)
+    client.geocode('Roma')
+    client.geocode('Milano')
+    client.geocode('Roma')
+    client.geocode('Napoli')
+
+    assert len(client.geocode_cache) == 2
+    client.geocode('Roma')
+    assert upstream.request_counts['geocode'] == 3
+    client.geocode('Milano')
+    assert upstream.request_counts['geocode'] == 4
+
+
+def test_ttl_cache_counters(clock):
+    cache = TTLCache(maxsize=10, ttl=10, stale_ttl=5)
+    assert cache.get('a') == (None, False)
+    cache.set('a', 1)
+    assert cache.get('a') == (1, True)
+    clock.advance(12)
+    assert cache.get('a') == (1, False)
+    clock.advance(10)
+    assert cache.get('a') == (None, False)
+    assert cache.stats() == {'size': 0, 'hits': 1, 'stale_hits': 1, 'misses': 2}
+
+
+def test_concurrent_misses_share_one_upstream_call(upstream):
+    upstream.latency = 0.2
+    client = make_client(upstream)
+    barrier = threading.Barrier(8)
+    results = []
+
+    def worker():
+        barrier.wait()
+        results.append(client.forecast(40.85, 14.27))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert upstream.request_counts['forecast'] == 1
+    assert client.stats()['coalesced'] == 7
+    assert all(result is results[0] for result in results)
@@ -0,0 +1,237 @@
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from forecast import aggregate_forecast
+
+
+# Errore restituito dall'API OpenWeatherMap (status diverso da 200)
+class WeatherAPIError(Exception):
+    def __init__(self, status_code, payload=None):
+        super().__init__(f'OpenWeatherMap ha risposto con status {status_code}')
+        self.status_code = status_code
+        self.payload = payload
+
+
+# Cache LRU limitata con scadenza (TTL) e finestra "stale" per la rivalidazione in background
+class TTLCache:
+    def __init__(self, maxsize, ttl, stale_ttl=0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._data = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        # Restituisce (valore, fresco) oppure (None, False) se la chiave manca o è troppo vecchia
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, False
+
+            value, stored_at = entry
+            age = now - stored_at
+            if age <= self.ttl:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value, True
+            if age <= self.ttl + self.stale_ttl:
+                self._data.move_to_end(key)
+                self.stale_hits += 1
+                return value, False
+
+            del self._data[key]
+            self.misses += 1
+            return None, False
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+
+def local_cache(name, maxsize, ttl, stale_ttl=0):
+    # Cache nel processo corrente; il nome serve alle cache condivise (shared_state.SharedCache)
+    return TTLCache(maxsize, ttl, stale_ttl)
+
+
+# Client OpenWeatherMap con connessioni riutilizzate, timeout espliciti e cache
+class WeatherClient:
+    def __init__(self, api_key, base_url='http://api.openweathermap.org', timeout=(3.05, 10),
+                 pool_size=10, geocode_ttl=7 * 24 * 3600, forecast_ttl=600, stale_ttl=300,
+                 cache_size=2048, cache_factory=local_cache):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.pool_size = pool_size
+
+        # Geocoding: i risultati cambiano raramente, quindi restano in cache a lungo
+        self.geocode_cache = cache_factory('geocode', cache_size, geocode_ttl, stale_ttl=geocode_ttl)
+        # Previsioni: circa 10 minuti più una finestra di rivalidazione in background
+        self.forecast_cache = cache_factory('forecast', cache_size, forecast_ttl, stale_ttl=stale_ttl)
+
+        self._start_pools()
+        self.upstream_calls = 0
+        self.upstream_errors = 0
+        # Richieste che hanno atteso una chiamata upstream già in corso per la stessa chiave
+        self.coalesced = 0
+        # Funzione opzionale observer(service, path, secondi, ok) chiamata dopo ogni chiamata upstream
+        self.observer = None
+
+    def _start_pools(self):
+        # Sessione unica con pool di connessioni keep-alive verso l'API
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='weather-refresh')
+        self._refreshing = set()
+        self._refreshing_lock = Lock()
+        # Chiamate upstream in corso: chiave -> Future con il risultato
+        self._in_flight = {}
+        self._in_flight_lock = Lock()
+
+    def after_fork(self):
+        # Nel processo figlio: connessioni e thread del padre non sono utilizzabili
+        self._start_pools()
+
+    def observe(self, path, seconds, ok):
+        if self.observer is not None:
+            self.observer('openweathermap', path, seconds, ok)
+
+    def _get(self, path, params):
+        params = dict(params, appid=self.api_key)
+        self.upstream_calls += 1
+        start = time.perf_counter()
+        try:
+            response = self.session.get(f'{self.base_url}{path}', params=params, timeout=self.timeout)
+        except requests.RequestException:
+            self.upstream_errors += 1
+            self.observe(path, time.perf_counter() - start, False)
+            raise
+
+        self.observe(path, time.perf_counter() - start, response.status_code == 200)
+        if response.status_code != 200:
+            self.upstream_errors += 1
+            raise WeatherAPIError(response.status_code, response.text)
+        return response.json()
+
+    def _cached(self, cache, key, fetch):
+        value, fresh = cache.get(key)
+        if value is not None:
+            if not fresh:
+                # Serve subito il valore scaduto e lo aggiorna in background
+                self._schedule_refresh(cache, key, fetch)
+            return value
+        return self._single_flight(cache, key, fetch)
+
+    def _single_flight(self, cache, key, fetch):
+        # Durante un picco le richieste concorrenti per la stessa chiave non ancora in cache
+        # attendono la chiamata upstream già in corso invece di ripeterla
+        with self._in_flight_lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._in_flight[key] = future
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+
+        try:
+            value = fetch()
+            cache.set(key, value)
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            with self._in_flight_lock:
+                self._in_flight.pop(key, None)
+
+    def _schedule_refresh(self, cache, key, fetch):
+        with self._refreshing_lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                cache.set(key, fetch())
+            except Exception:
+                # In caso di errore resta il valore precedente fino alla scadenza
+                pass
+            finally:
+                with self._refreshing_lock:
+                    self._refreshing.discard(key)
+
+        self._refresh_executor.submit(refresh)
+
+    @staticmethod
+    def normalize_query(query):
+        return ' '.join(query.lower().split())
+
+    @staticmethod
+    def forecast_key(lat, lon):
+        # Due decimali (circa 1 km) bastano per condividere la cache tra ricerche vicine
+        return round(lat, 2), round(lon, 2)
+
+    def geocode(self, query, limit=5):
+        # Converte un nome di città in una lista di località con coordinate
+        normalized = self.normalize_query(query)
+        key = ('geocode', normalized, limit)
+        return self._cached(self.geocode_cache, key,
+                            lambda: self._get('/geo/1.0/direct', {'q': normalized, 'limit': limit}))
+
+    def forecast(self, lat, lon):
+        # Previsioni a 5 giorni per le coordinate indicate, già aggregate per giorno:
+        # in cache finisce il risultato elaborato, riutilizzato da tutti gli utenti
+        lat, lon = self.forecast_key(lat, lon)
+        key = ('forecast', lat, lon)
+        return self._cached(self.forecast_cache, key,
+                            lambda: aggregate_forecast(self._get('/data/2.5/forecast',
+                                                                 {'lat': lat, 'lon': lon, 'units': 'metric', 'lang': 'it'})))
+
+    def stats(self):
+        return {
+            'geocode': self.geocode_cache.stats(),
+            'forecast': self.forecast_cache.stats(),
+            'upstream_calls': self.upstream_calls,
+            'upstream_errors': self.upstream_errors,
+            'coalesced': self.coalesced
+        }
+
+    def clear(self):
+        self.geocode_cache.clear()
+        self.forecast_cache.clear()
@@ -0,0 +1,5 @@
+# Punto di ingresso WSGI per i server di produzione:
+#   gunicorn -c gunicorn.conf.py
+from sito import create_app
+
+app = create_app()